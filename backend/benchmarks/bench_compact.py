@@ -0,0 +1,61 @@
+"""
+Size and render time of default versus compact Mermaid output.
+
+For each document in the benchmark corpus this reports the Mermaid code
+size, the length of the mermaid.ink URL it turns into, and generation
+time. With --render it also times a real render on mermaid.ink.
+
+    python benchmarks/bench_compact.py [--render]
+"""
+import argparse
+import base64
+import os
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import corpus
+from langgraph_app.tools import parse_json_to_mermaid
+
+def render_seconds(mermaid_code):
+    """Time one mermaid.ink render; None if the service rejected the request"""
+    encoded = base64.urlsafe_b64encode(mermaid_code.encode("utf-8")).decode("utf-8")
+    start = time.perf_counter()
+    response = requests.get(f"https://mermaid.ink/svg/{encoded}", timeout=60)
+    elapsed = time.perf_counter() - start
+    return elapsed if response.status_code == 200 else None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--render", action="store_true", help="also time rendering on mermaid.ink (needs network)")
+    args = parser.parse_args()
+
+    header = f"{'document':<10}{'mode':<9}{'bytes':>9}{'url bytes':>11}{'gen ms':>9}"
+    if args.render:
+        header += f"{'render s':>10}"
+    print(header)
+
+    for name, document in corpus().items():
+        sizes = {}
+        for mode in ("default", "compact"):
+            start = time.perf_counter()
+            code = parse_json_to_mermaid(document, compact=(mode == "compact"))
+            generate_ms = (time.perf_counter() - start) * 1000
+            url_bytes = len("https://mermaid.ink/svg/") + len(base64.urlsafe_b64encode(code.encode("utf-8")))
+            sizes[mode] = len(code)
+
+            row = f"{name:<10}{mode:<9}{len(code):>9}{url_bytes:>11}{generate_ms:>9.1f}"
+            if args.render:
+                try:
+                    seconds = render_seconds(code)
+                    row += f"{seconds:>10.2f}" if seconds is not None else f"{'failed':>10}"
+                except requests.RequestException:
+                    row += f"{'error':>10}"
+            print(row)
+        print(f"{'':<10}compact is {sizes['compact'] / sizes['default']:.0%} of default\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Throughput of Mermaid generation for large documents, inline versus the
+process pool, as the number of pool workers grows.
+
+Concurrent requests are simulated with a thread per in-flight document,
+which is how Django's threaded servers dispatch them. Inline generation
+is bound by the GIL; the pool should scale with the number of workers.
+Both sides parse, hash, validate and convert each document. With a
+single core the pool only adds copying and process hops, so expect it
+to lose there.
+
+    python benchmarks/bench_pool.py [--requests 32] [--size 1000000]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import make_document
+from langgraph_app.pool import create_pool, generate_mermaid_offloaded
+from langgraph_app.tools import canonical_hash, parse_json_to_mermaid, validate_json
+
+def inline(raw_json):
+    """The pool worker's work, done on the calling thread"""
+    json_data = json.loads(raw_json)
+    canonical_hash(json_data)
+    validate_json(json_data, max_bytes=None)
+    return parse_json_to_mermaid(json_data)
+
+def measure(fn, payloads, concurrency):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as threads:
+        list(threads.map(fn, payloads))
+    return len(payloads) / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=32, help="documents to process per run")
+    parser.add_argument("--size", type=int, default=1_000_000, help="approximate document size in bytes, up to POOL_MAX_BYTES")
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    payloads = [json.dumps(make_document(args.size, seed=i)).encode("utf-8") for i in range(args.requests)]
+    print(f"{args.requests} documents of ~{args.size} bytes, {cores} CPU(s)\n")
+    print(f"{'mode':<12}{'workers':>8}{'docs/s':>10}{'speedup':>10}")
+
+    baseline = measure(inline, payloads, concurrency=cores)
+    print(f"{'inline':<12}{'-':>8}{baseline:>10.1f}{1.0:>10.2f}")
+
+    # 1, 2, 4, ... workers, always finishing at the full core count
+    for workers in sorted({min(2 ** i, cores) for i in range(cores.bit_length() + 1)}):
+        pool = create_pool(workers)
+        try:
+            rate = measure(lambda raw: generate_mermaid_offloaded(raw, pool=pool), payloads, concurrency=workers * 2)
+        finally:
+            pool.shutdown()
+        print(f"{'pool':<12}{workers:>8}{rate:>10.1f}{rate / baseline:>10.2f}")
+
+if __name__ == "__main__":
+    main()
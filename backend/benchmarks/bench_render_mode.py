@@ -0,0 +1,65 @@
+"""
+Server-side versus client-side rendering (?render=client).
+
+For each document in the benchmark corpus this runs the diagram pipeline
+in both modes, once with default and once with compact Mermaid code
+("+c" rows), and reports the server CPU time, the size of the JSON
+response and the server's wall-clock latency. Server mode renders on the
+remote services, so it needs network access; results that came back as
+a fallback SVG are marked. The transfer column estimates download time
+at --mbps.
+
+In client mode the browser still has to render the diagram with
+mermaid.js. Add that time, shown in the browser's performance panel,
+to the client-mode latency for a true end-to-end comparison.
+
+    python benchmarks/bench_render_mode.py [--mbps 10]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import corpus
+from langgraph_app.agent import process_json_with_agent
+from langgraph_app.tools import is_fallback_svg
+
+# Both render modes at each code style, so rows compare like with like
+MODES = {
+    "server": {"compact": False, "client_render": False},
+    "client": {"compact": False, "client_render": True},
+    "server+c": {"compact": True, "client_render": False},
+    "client+c": {"compact": True, "client_render": True},
+}
+
+def run(document, **options):
+    """Run the pipeline once; returns the result, CPU seconds and wall seconds"""
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    result = asyncio.run(process_json_with_agent(document, **options))
+    return result, time.process_time() - cpu_start, time.perf_counter() - wall_start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mbps", type=float, default=10.0, help="client bandwidth for the transfer estimate")
+    args = parser.parse_args()
+
+    print(f"{'document':<10}{'mode':<10}{'cpu ms':>9}{'bytes':>10}{'transfer ms':>13}{'server ms':>11}  note")
+    for name, document in corpus().items():
+        for mode, options in MODES.items():
+            result, cpu, wall = run(document, **options)
+            if not result.get("success"):
+                print(f"{name:<10}{mode:<10}{'':>9}{'':>10}{'':>13}{wall * 1000:>11.0f}  error: {result.get('error')}")
+                continue
+            body = json.dumps({"mermaid_code": result["mermaid_code"], "diagram_image": result["diagram_image"]})
+            transfer_ms = len(body) * 8 / (args.mbps * 1_000_000) * 1000
+            note = "fallback SVG" if result["diagram_image"] and is_fallback_svg(result["diagram_image"]) else ""
+            print(f"{name:<10}{mode:<10}{cpu * 1000:>9.1f}{len(body):>10}{transfer_ms:>13.1f}{wall * 1000:>11.0f}  {note}")
+        print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+# Synthetic JSON documents shared by the benchmark scripts
+import json
+import random
+from typing import Any, Dict, List
+
+def make_document(target_bytes: int, seed: int = 0) -> Dict[str, Any]:
+    """
+    Build a nested, API-response-like document of roughly target_bytes
+    when serialized. Objects are nested a few levels deep and arrays stay
+    short, so the whole document is drawn rather than summarized.
+    """
+    rng = random.Random(seed)
+    words = ["id", "name", "status", "created", "owner", "region", "price", "tags", "active", "score"]
+
+    def leaf():
+        return rng.choice([
+            rng.randint(0, 10_000),
+            round(rng.random() * 100, 2),
+            rng.choice(words) + "-" + str(rng.randint(0, 99)),
+            rng.random() < 0.5,
+            None,
+        ])
+
+    def branch(depth):
+        if depth >= 4:
+            return leaf()
+        node = {}
+        for i in range(rng.randint(2, 5)):
+            kind = rng.random()
+            key = f"{rng.choice(words)}_{i}"
+            if kind < 0.5:
+                node[key] = leaf()
+            elif kind < 0.8:
+                node[key] = branch(depth + 1)
+            else:
+                node[key] = [branch(depth + 2) for _ in range(rng.randint(1, 4))]
+        return node
+
+    document = {}
+    while len(json.dumps(document)) < target_bytes:
+        document[f"record_{len(document)}"] = branch(0)
+    return document
+
+def corpus(sizes: List[int] = (1_000, 10_000, 50_000, 95_000)) -> Dict[str, Dict[str, Any]]:
+    """Named documents of increasing size, all within the validate_json limit"""
+    return {f"{size // 1000}kb": make_document(size, seed=size) for size in sizes}
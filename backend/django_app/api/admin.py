@@ -1,3 +1,17 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import Blob, Diagram
+
+
+@admin.register(Diagram)
+class DiagramAdmin(admin.ModelAdmin):
+    list_display = ("document_hash", "mode", "hits", "created_at")
+    list_filter = ("mode",)
+    search_fields = ("document_hash",)
+
+
+@admin.register(Blob)
+class BlobAdmin(admin.ModelAdmin):
+    list_display = ("digest", "size", "created_at")
+    search_fields = ("digest",)
+    exclude = ("data",)
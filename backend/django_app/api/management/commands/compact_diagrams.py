@@ -0,0 +1,85 @@
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from api.models import Blob, Diagram, manifest_digests
+
+
+class Command(BaseCommand):
+    help = "Delete diagrams and request profiles older than their retention periods and reclaim unused storage"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=30,
+            help="Keep diagrams created within this many days (default: 30)",
+        )
+        parser.add_argument(
+            "--profile-days",
+            type=int,
+            default=7,
+            help="Keep request profiles saved within this many days (default: 7)",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report what would be deleted without deleting anything",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options["days"])
+        expired = Diagram.objects.filter(created_at__lt=cutoff)
+        profiles = self.expired_profiles(options["profile_days"])
+
+        if options["dry_run"]:
+            self.stdout.write(f"Would delete {expired.count()} diagram(s) created before {cutoff:%Y-%m-%d %H:%M}")
+            self.stdout.write(f"Would delete {len(profiles)} profile file(s) older than {options['profile_days']} day(s)")
+            return
+
+        # Sampled profiling (PROFILE_SAMPLE_RATE) keeps writing files, so they expire too
+        for path in profiles:
+            path.unlink(missing_ok=True)
+
+        deleted_diagrams, _ = expired.delete()
+
+        # Blobs are shared between diagrams, so only drop the ones nothing points at any more:
+        # neither a diagram's foreign keys nor the page manifest of a partitioned diagram
+        in_manifests = set()
+        for manifest in Blob.objects.filter(pages_diagrams__isnull=False).distinct():
+            in_manifests.update(manifest_digests(json.loads(manifest.text())))
+        orphans = Blob.objects.filter(
+            mermaid_diagrams__isnull=True,
+            svg_diagrams__isnull=True,
+            pages_diagrams__isnull=True,
+        ).values_list("pk", "digest")
+        orphan_ids = [pk for pk, digest in orphans if digest not in in_manifests]
+        deleted_blobs = 0
+        for start in range(0, len(orphan_ids), 500):
+            deleted, _ = Blob.objects.filter(pk__in=orphan_ids[start:start + 500]).delete()
+            deleted_blobs += deleted
+
+        # VACUUM can't run inside a transaction, e.g. when called from another command's atomic block
+        if connection.vendor == "sqlite" and not connection.in_atomic_block:
+            with connection.cursor() as cursor:
+                cursor.execute("VACUUM")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {deleted_diagrams} diagram(s), {deleted_blobs} unused blob(s) and {len(profiles)} profile file(s)"
+        ))
+
+    def expired_profiles(self, days):
+        """Saved request profiles last written more than days ago"""
+        directory = settings.PROFILE_DIR
+        if not directory.is_dir():
+            return []
+        cutoff = time.time() - days * 24 * 60 * 60
+        return [
+            path for path in directory.iterdir()
+            if path.suffix in (".pstats", ".collapsed") and path.stat().st_mtime < cutoff
+        ]
@@ -0,0 +1,75 @@
+import hmac
+import logging
+import random
+import uuid
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from langgraph_app.profiling import request_profile
+
+logger = logging.getLogger(__name__)
+
+
+def has_profile_token(request) -> bool:
+    """Check the privileged X-Flow-Profile header against PROFILE_TOKEN"""
+    token = settings.PROFILE_TOKEN
+    # Compared as bytes: compare_digest rejects non-ASCII str, and headers are latin-1
+    supplied = request.headers.get("X-Flow-Profile", "").encode("latin-1", "replace")
+    return bool(token) and hmac.compare_digest(supplied, token.encode())
+
+
+class ProfilingMiddleware:
+    """
+    Attach a Server-Timing header with the pipeline's section timings to
+    every response. Requests carrying the profile token, plus a sampled
+    PROFILE_SAMPLE_RATE fraction of all requests, are also CPU profiled;
+    the profile is saved under PROFILE_DIR and its ID returned in the
+    X-Flow-Profile-Id header for download from /api/profiles/.
+
+    Works in both sync and async chains, so async views keep receiving
+    client disconnects as cancellation. In an async chain the view runs on
+    the event loop thread, which other requests share, so only the workflow
+    nodes and worker threads are CPU profiled; the view is just timed.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def should_profile(self, request) -> bool:
+        if has_profile_token(request):
+            return True
+        return random.random() < settings.PROFILE_SAMPLE_RATE
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
+        cpu = self.should_profile(request)
+        with request_profile(cpu=cpu) as profile:
+            with profile.section("view"):
+                response = self.get_response(request)
+        return self.finish(response, profile, cpu)
+
+    async def __acall__(self, request):
+        cpu = self.should_profile(request)
+        with request_profile(cpu=cpu) as profile:
+            with profile.section("view", profile_thread=False):
+                response = await self.get_response(request)
+        return self.finish(response, profile, cpu)
+
+    def finish(self, response, profile, cpu: bool):
+        response["Server-Timing"] = profile.server_timing()
+        if cpu:
+            profile_id = uuid.uuid4().hex
+            try:
+                profile.save(settings.PROFILE_DIR, profile_id)
+                response["X-Flow-Profile-Id"] = profile_id
+            except OSError:
+                logger.exception("Could not save request profile")
+        return response
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-19 00:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='diagram',
+            name='pages',
+            field=models.ForeignKey(blank=True, help_text='JSON manifest of linked pages for partitioned diagrams', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='pages_diagrams', to='api.blob'),
+        ),
+    ]
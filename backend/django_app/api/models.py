@@ -1,3 +1,135 @@
+import hashlib
+import json
+import zlib
+from typing import Any, Dict, List, Optional
+
 from django.db import models
+from django.db.models import F
+
+
+class BlobManager(models.Manager):
+    def store(self, text: str) -> "Blob":
+        """Store text once per distinct content and return its blob"""
+        raw = text.encode("utf-8")
+        digest = hashlib.sha256(raw).hexdigest()
+        blob, _ = self.get_or_create(
+            digest=digest,
+            defaults={"data": zlib.compress(raw, 6), "size": len(raw)},
+        )
+        return blob
+
+
+class Blob(models.Model):
+    """
+    A compressed, content-addressed payload (Mermaid code or SVG).
+    Diagrams that produce identical output share a single blob.
+    """
+    digest = models.CharField(max_length=64, unique=True)
+    data = models.BinaryField()
+    size = models.PositiveIntegerField(help_text="Uncompressed size in bytes")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = BlobManager()
+
+    def text(self) -> str:
+        return zlib.decompress(self.data).decode("utf-8")
+
+    def __str__(self):
+        return f"{self.digest[:12]} ({self.size} bytes)"
+
+
+def page_manifest(pages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Pages with their Mermaid code and SVG stored as blobs of their own and
+    replaced by the blobs' digests, so each is stored once however many
+    diagrams or pages share it (the overview page's SVG is the diagram's SVG).
+    """
+    manifest = []
+    for page in pages:
+        entry = {key: value for key, value in page.items() if key not in ("mermaid_code", "diagram_image")}
+        entry["mermaid"] = Blob.objects.store(page["mermaid_code"]).digest
+        if page.get("diagram_image"):
+            entry["svg"] = Blob.objects.store(page["diagram_image"]).digest
+        manifest.append(entry)
+    return manifest
+
+
+def manifest_digests(manifest: List[Dict[str, Any]]) -> List[str]:
+    """Digests of the blobs a page manifest points at"""
+    return [page[key] for page in manifest for key in ("mermaid", "svg") if page.get(key)]
+
+
+class DiagramManager(models.Manager):
+    def lookup(self, document_hash: str, mode: str = "default") -> Optional[Dict[str, Any]]:
+        """Return a stored result for the document, or None if it has not been seen"""
+        diagram = (
+            self.select_related("mermaid", "svg", "pages")
+            .filter(document_hash=document_hash, mode=mode)
+            .first()
+        )
+        if diagram is None:
+            return None
+        self.filter(pk=diagram.pk).update(hits=F("hits") + 1)
+        result = {
+            "success": True,
+            "mermaid_code": diagram.mermaid.text(),
+            "diagram_image": diagram.svg.text() if diagram.svg else "",
+        }
+        if diagram.pages_id:
+            result["pages"] = diagram.page_list()
+        return result
+
+    def record(self, document_hash: str, result: Dict[str, Any], mode: str = "default") -> "Diagram":
+        """Persist a successful pipeline result for the document"""
+        svg = result.get("diagram_image", "")
+        pages = result.get("pages")
+        diagram, _ = self.update_or_create(
+            document_hash=document_hash,
+            mode=mode,
+            defaults={
+                "mermaid": Blob.objects.store(result.get("mermaid_code", "")),
+                "svg": Blob.objects.store(svg) if svg else None,
+                "pages": Blob.objects.store(json.dumps(page_manifest(pages))) if pages else None,
+            },
+        )
+        return diagram
+
+
+class Diagram(models.Model):
+    """A generated diagram, keyed by the canonical hash of its input document"""
+    document_hash = models.CharField(max_length=64, db_index=True)
+    mode = models.CharField(max_length=32, default="default")
+    mermaid = models.ForeignKey(Blob, on_delete=models.PROTECT, related_name="mermaid_diagrams")
+    svg = models.ForeignKey(Blob, on_delete=models.PROTECT, related_name="svg_diagrams", null=True, blank=True)
+    pages = models.ForeignKey(
+        Blob, on_delete=models.PROTECT, related_name="pages_diagrams", null=True, blank=True,
+        help_text="JSON manifest of linked pages for partitioned diagrams, holding blob digests",
+    )
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    objects = DiagramManager()
+
+    class Meta:
+        ordering = ["-created_at"]
+        constraints = [
+            models.UniqueConstraint(fields=["document_hash", "mode"], name="unique_document_mode"),
+        ]
+
+    def page_list(self) -> List[Dict[str, Any]]:
+        """The pages of a partitioned diagram, with their Mermaid code and SVG loaded"""
+        if not self.pages_id:
+            return []
+        manifest = json.loads(self.pages.text())
+        texts = {blob.digest: blob.text() for blob in Blob.objects.filter(digest__in=manifest_digests(manifest))}
+        pages = []
+        for entry in manifest:
+            page = {key: value for key, value in entry.items() if key not in ("mermaid", "svg")}
+            page["mermaid_code"] = texts[entry["mermaid"]]
+            if entry.get("svg"):
+                page["diagram_image"] = texts[entry["svg"]]
+            pages.append(page)
+        return pages
 
-# Create your models here.
+    def __str__(self):
+        return f"{self.document_hash[:12]} [{self.mode}]"
@@ -1,3 +1,841 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from multiprocessing import shared_memory
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.http import StreamingHttpResponse
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, override_settings
+
+from langgraph_app.tools import (
+    MERMAID_KEYWORDS,
+    canonical_hash,
+    generate_svg_from_mermaid,
+    is_fallback_svg,
+    iter_json_to_mermaid,
+    parse_json_to_mermaid,
+    partition_json,
+    partition_json_to_mermaid,
+    short_ids,
+    validate_json,
+)
+from langgraph_app import pool, schema
+from langgraph_app.deadline import Deadline, remaining_or
+
+
+def nested(depth):
+    """{"level0": {"level1": ... {"levelN": "leaf"}}}"""
+    value = "leaf"
+    for level in range(depth, -1, -1):
+        value = {f"level{level}": value}
+    return value
+
+
+class CompactMermaidTests(SimpleTestCase):
+    def test_depth_limit_matches_default_mode(self):
+        data = nested(8)
+        compact = parse_json_to_mermaid(data, compact=True)
+        default = parse_json_to_mermaid(data)
+        for level in range(6):
+            self.assertIn(f"level{level}", compact)
+            self.assertIn(f"level{level}", default)
+        for level in range(6, 9):
+            self.assertNotIn(f"level{level}", compact)
+            self.assertNotIn(f"level{level}", default)
+
+    def test_large_arrays_are_summarized(self):
+        compact = parse_json_to_mermaid({"items": list(range(11))}, compact=True)
+        node_id = re.search(r"^(\w+)\[items: Array with 11 items\]$", compact, re.M).group(1)
+        self.assertNotIn("Item 0", compact)
+        self.assertIn(f"class {node_id} a\n", compact)
+
+    def test_arrays_up_to_ten_items_are_drawn(self):
+        compact = parse_json_to_mermaid({"items": list(range(10))}, compact=True)
+        self.assertNotIn("Array with", compact)
+        for index in range(10):
+            self.assertIn(f"[Item {index}: {index}]", compact)
+
+    def test_primitive_keys_become_one_node(self):
+        compact = parse_json_to_mermaid({"name": "flow", "count": 3}, compact=True)
+        self.assertIn("[name: flow]", compact)
+        self.assertIn("[count: 3]", compact)
+        self.assertNotIn("-->", compact)
+
+    def test_short_ids_avoid_keywords_and_edge_letters(self):
+        ids = short_ids()
+        seen = [next(ids) for _ in range(5000)]
+        self.assertEqual(len(seen), len(set(seen)))
+        for node_id in seen:
+            self.assertNotIn(node_id[0], "ox")
+            self.assertNotIn(node_id.lower(), MERMAID_KEYWORDS)
+
+
+SAMPLE = {"name": "flow", "tags": ["a", 1], "meta": {"ok": True, "n": None}}
+
+SAMPLE_MERMAID = """graph TD;
+    "N0"[name]
+    "V1"[flow]
+    "N0" --> "V1"
+    "N2"[tags]
+    "N3"[Item 0]
+    "N2" --> "N3"
+    "V4"[a]
+    "N3" --> "V4"
+    "N5"[Item 1]
+    "N2" --> "N5"
+    "V6"[1]
+    "N5" --> "V6"
+    "N7"[meta]
+    "N8"[ok]
+    "N7" --> "N8"
+    "V9"[True]
+    "N8" --> "V9"
+    "N10"[n]
+    "N7" --> "N10"
+"""
+
+SAMPLE_COMPACT = """graph TD
+classDef k fill:#e8f0fe,stroke:#4a6fa5
+classDef v fill:#f1f8e9,stroke:#7cb342
+classDef a fill:#fff3e0,stroke:#fb8c00
+classDef p fill:#f3e5f5,stroke:#8e24aa,stroke-dasharray:4
+a[name: flow]
+b[tags]-->c[Item 0: a] & d[Item 1: 1]
+e[meta]-->f[ok: True] & g[n]
+class b,e,g k
+class a,c,d,f v
+"""
+
+
+class MermaidEmitterTests(SimpleTestCase):
+    def test_output_is_unchanged(self):
+        self.assertEqual("".join(iter_json_to_mermaid(SAMPLE)), SAMPLE_MERMAID)
+        self.assertEqual(parse_json_to_mermaid(SAMPLE), SAMPLE_MERMAID)
+        self.assertEqual(parse_json_to_mermaid(SAMPLE, compact=True), SAMPLE_COMPACT)
+
+    def test_deep_nesting_does_not_recurse(self):
+        deep_object, deep_array = "leaf", []
+        for _ in range(5000):
+            deep_object, deep_array = {"k": deep_object}, [deep_array]
+        # Only the levels down to the depth limit are drawn
+        for compact in (False, True):
+            self.assertEqual(parse_json_to_mermaid(deep_object, compact).count("[k]"), 6)
+            self.assertEqual(parse_json_to_mermaid(deep_array, compact).count("[Item 0]"), 6)
+
+
+class StreamMermaidViewTests(SimpleTestCase):
+    def setUp(self):
+        self.client = Client(HTTP_ORIGIN="http://localhost:3000")
+
+    def test_streams_the_same_code(self):
+        for query, compact in (("", False), ("?compact=1", True)):
+            response = self.client.post(f"/api/stream-mermaid/{query}", data=SAMPLE, content_type="application/json")
+            self.assertEqual(response.status_code, 200)
+            self.assertIsInstance(response, StreamingHttpResponse)
+            content = b"".join(response.streaming_content).decode()
+            self.assertEqual(content, parse_json_to_mermaid(SAMPLE, compact))
+
+    def test_invalid_json(self):
+        response = self.client.post("/api/stream-mermaid/", data="{not json", content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["error"], "Invalid JSON file")
+
+
+def page_nodes(page):
+    """Nodes drawn for a partition_json() page, link nodes included"""
+    code = "".join(iter_json_to_mermaid(page["data"], links=page["links"]))
+    return len(re.findall(r'^    "\w+"\[', code, re.M))
+
+
+class PartitionTests(SimpleTestCase):
+    def assertLinked(self, pages):
+        """Every link points at an existing page and every page but the overview is linked once"""
+        ids = [page["id"] for page in pages]
+        targets = []
+        for page in pages:
+            targets += [href[1:] for href in page["links"].values()]
+        self.assertEqual(sorted(targets), sorted(ids[1:]))
+
+    def test_document_within_budget_is_one_page(self):
+        data = {"a": {"b": 1}, "c": [1, 2]}
+        pages = partition_json(data, 200)
+        self.assertEqual(len(pages), 1)
+        self.assertIs(pages[0]["data"], data)
+
+    def test_small_records_are_grouped(self):
+        records = [{"a": i, "b": "x", "c": True, "d": 1.5, "e": "y"} for i in range(400)]
+        pages = partition_json(records, 200)
+        # 11 nodes per record: 18 records per page, one link per page on the overview
+        self.assertEqual(len(pages), 24)
+        self.assertEqual(len(pages[0]["data"]), 23)
+        self.assertEqual(pages[1]["title"], "Item 0 … Item 17")
+        for page in pages:
+            self.assertLessEqual(page_nodes(page), 200)
+        self.assertLinked(pages)
+
+    def test_only_oversized_subtrees_get_their_own_page(self):
+        data = {"big": {f"k{i}": i for i in range(150)}, "small": {"x": 1}, "flag": True}
+        pages = partition_json(data, 100)
+        overview = pages[0]
+        self.assertEqual(set(overview["data"]), {"big", "small", "flag"})
+        self.assertIs(overview["data"]["small"], data["small"])
+        self.assertEqual(list(overview["links"].values()), ["#page-1"])
+        self.assertEqual(pages[1]["title"], "big")
+        for page in pages:
+            self.assertLessEqual(page_nodes(page), 100)
+        self.assertLinked(pages)
+
+    def test_overview_with_many_links_uses_index_pages(self):
+        data = {f"k{i}": i for i in range(5000)}
+        pages = partition_json(data, 10)
+        for page in pages:
+            self.assertLessEqual(page_nodes(page), 10)
+        self.assertLinked(pages)
+
+    def test_manifest_links_point_at_pages(self):
+        records = [{"a": i, "b": "x"} for i in range(100)]
+        for compact in (False, True):
+            manifest = partition_json_to_mermaid(records, 50, compact)
+            ids = {page["id"] for page in manifest}
+            hrefs = re.findall(r'href "#([\w-]+)"', "".join(page["mermaid_code"] for page in manifest))
+            self.assertEqual(len(hrefs), len(manifest) - 1)
+            self.assertLessEqual(set(hrefs), ids)
+
+
+class OffloadedRenderTests(SimpleTestCase):
+    def render_calls(self, offloaded):
+        from langgraph_app.agent import process_json_with_agent
+        
+        with mock.patch("langgraph_app.agent.generate_svg_from_mermaid", return_value="<svg/>") as render:
+            result = asyncio.run(process_json_with_agent(None, offloaded=offloaded))
+        self.assertTrue(result["success"])
+        return render.call_count
+
+    def test_offloaded_document_is_rendered_once(self):
+        offloaded = {"document_hash": "x", "mermaid_code": parse_json_to_mermaid({"a": 1})}
+        self.assertEqual(self.render_calls(offloaded), 1)
+
+    def test_offloaded_pages_are_rendered_once_each(self):
+        pages = partition_json_to_mermaid({"big": {f"k{i}": i for i in range(10)}, "x": 1}, 6)
+        self.assertGreater(len(pages), 1)
+        offloaded = {"document_hash": "x", "mermaid_code": pages[0]["mermaid_code"], "pages": pages}
+        self.assertEqual(self.render_calls(offloaded), len(pages))
+
+
+def ndjson_lines(count, seed=0):
+    """NDJSON records of varying length and shape, with a blank and an invalid line mixed in"""
+    rng = random.Random(seed)
+    lines = []
+    for i in range(count):
+        record = {"id": i, "level": rng.choice(["info", "warn", "error"])}
+        if i % 3:
+            record["user"] = {"name": f"user{i % 17}", "tags": ["x"] * rng.randint(0, 4)}
+        if i % 5 == 0:
+            record["message"] = "m" * rng.randint(1, 300)
+        lines.append(json.dumps(record))
+    lines[count // 2] = "not json"
+    lines.insert(count // 3, "")
+    return ("\n".join(lines) + "\n").encode()
+
+
+def snapshot(aggregator):
+    return json.dumps([aggregator.summary(), aggregator.to_document()])
+
+
+def shared_block(data, flag=0):
+    """A shared memory block holding data followed by a cancellation flag byte"""
+    shm = shared_memory.SharedMemory(create=True, size=len(data) + 1)
+    shm.buf[:len(data)] = data
+    shm.buf[len(data)] = flag
+    return shm
+
+
+class SharedMemoryPoolTests(SimpleTestCase):
+    def offload(self, raw_json, **options):
+        with ThreadPoolExecutor(1) as executor:
+            return pool.generate_mermaid_offloaded(raw_json, pool=executor, **options)
+
+    def test_large_document_is_converted(self):
+        data = {f"key{i}": {"value": "x" * 100, "index": i} for i in range(1500)}
+        raw_json = json.dumps(data).encode()
+        # Past the 100 KB limit for the request thread, within POOL_MAX_BYTES
+        self.assertGreater(len(raw_json), 100000)
+        result = self.offload(raw_json, deadline=Deadline(60))
+        self.assertEqual(result["mermaid_code"], parse_json_to_mermaid(data))
+        self.assertEqual(result["document_hash"], canonical_hash(data))
+
+    def test_invalid_json_fails_in_validate(self):
+        result = self.offload(b'{"a": ')
+        self.assertEqual(result["error_node"], "validate")
+        self.assertNotIn("document_hash", result)
+
+    def test_document_over_the_pool_limit_is_rejected(self):
+        with mock.patch.object(pool, "POOL_MAX_BYTES", 10), \
+                mock.patch.object(pool, "_generate_from_shared_memory") as worker:
+            result = self.offload(b'{"a": "more than ten bytes"}')
+        self.assertEqual(result, {"error": "JSON data is too large", "error_node": "validate"})
+        worker.assert_not_called()
+
+    def test_expired_deadline_times_out(self):
+        release = threading.Event()
+        with ThreadPoolExecutor(1) as executor:
+            executor.submit(release.wait)
+            with self.assertRaises(FuturesTimeoutError):
+                pool.generate_mermaid_offloaded(b'{"a": 1}', pool=executor, deadline=Deadline(0.2))
+            release.set()
+
+    def test_shared_memory_is_unlinked(self):
+        blocks = []
+        create = shared_memory.SharedMemory
+
+        def record(*args, **kwargs):
+            block = create(*args, **kwargs)
+            blocks.append(block.name)
+            return block
+
+        with mock.patch.object(shared_memory, "SharedMemory", side_effect=record):
+            self.offload(b'{"a": 1}')
+            self.offload(b'not json')
+        self.assertEqual(len(blocks), 4)  # each call's block, and the worker attaching to it
+        for name in set(blocks):
+            with self.assertRaises(FileNotFoundError):
+                create(name=name)
+
+
+class PoolCancellationTests(SimpleTestCase):
+    def cancel_soon(self, deadline):
+        timer = threading.Timer(0.2, deadline.cancel)
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+    def test_wait_stops_soon_after_cancellation(self):
+        deadline = Deadline(60)
+        self.cancel_soon(deadline)
+        started = time.monotonic()
+        with self.assertRaises(FuturesTimeoutError):
+            pool.wait_for(Future(), deadline)
+        self.assertLess(time.monotonic() - started, 2)
+
+    def test_cancelled_request_stops_its_worker(self):
+        release = threading.Event()
+        with ThreadPoolExecutor(1) as executor:
+            # Keep the only worker busy, so the job is still queued when the request gives up
+            executor.submit(release.wait)
+            deadline = Deadline(60)
+            self.cancel_soon(deadline)
+            with mock.patch.object(pool, "_generate_from_shared_memory") as worker:
+                with self.assertRaises(FuturesTimeoutError):
+                    pool.generate_mermaid_offloaded(b'{"a": 1}', pool=executor, deadline=deadline)
+                release.set()
+        worker.assert_not_called()
+
+    def test_worker_sees_the_cancellation_flag(self):
+        data = json.dumps({"a": 1}).encode()
+        shm = shared_block(data, flag=1)
+        self.addCleanup(shm.unlink)
+        self.addCleanup(shm.close)
+        result = pool._generate_from_shared_memory(shm.name, len(data))
+        self.assertTrue(result["timed_out"])
+        self.assertNotIn("mermaid_code", result)
+
+    def test_ndjson_worker_sees_the_cancellation_flag(self):
+        handle, path = tempfile.mkstemp(suffix=".ndjson")
+        with os.fdopen(handle, "wb") as f:
+            f.write(ndjson_lines(3000))
+        self.addCleanup(os.remove, path)
+        flag = shared_block(b"", flag=1)
+        self.addCleanup(flag.unlink)
+        self.addCleanup(flag.close)
+        with self.assertRaises(TimeoutError):
+            schema._aggregate_range(path, 0, os.path.getsize(path), cancel_flag=flag.name)
+
+
+class SchemaAggregationTests(SimpleTestCase):
+    def setUp(self):
+        self.data = ndjson_lines(3000)
+        handle, self.path = tempfile.mkstemp(suffix=".ndjson")
+        with os.fdopen(handle, "wb") as f:
+            f.write(self.data)
+        self.addCleanup(os.remove, self.path)
+        self.serial = schema.SchemaAggregator().add_lines(self.data.splitlines())
+
+    def test_byte_ranges_match_a_serial_pass(self):
+        size = len(self.data)
+        for chunks in (2, 3, 7, 64):
+            merged = schema.SchemaAggregator()
+            for start, end in schema.byte_ranges(size, chunks):
+                merged.merge(schema._aggregate_range(self.path, start, end))
+            self.assertEqual(snapshot(merged), snapshot(self.serial), f"{chunks} chunks")
+        self.assertEqual(self.serial.summary(), {"records": 2999, "invalid_lines": 1})
+
+    def test_range_boundaries_on_every_byte_of_a_line(self):
+        newline = self.data.index(b"\n", 100)
+        for cut in range(newline - 2, newline + 3):
+            merged = schema._aggregate_range(self.path, 0, cut)
+            merged.merge(schema._aggregate_range(self.path, cut, len(self.data)))
+            self.assertEqual(snapshot(merged), snapshot(self.serial), f"cut at {cut}")
+
+    def test_file_aggregation_in_the_pool(self):
+        with ThreadPoolExecutor(4) as pool, \
+                mock.patch("langgraph_app.pool.get_pool", return_value=pool), \
+                mock.patch.object(schema, "MIN_CHUNK_BYTES", 1000):
+            aggregated = schema.aggregate_ndjson_file(self.path, workers=4)
+        self.assertEqual(snapshot(aggregated), snapshot(self.serial))
+
+    def test_expired_deadline_stops_aggregation(self):
+        deadline = Deadline(60)
+        deadline.cancel()
+        with self.assertRaises(TimeoutError):
+            schema.SchemaAggregator().add_lines(self.data.splitlines(), deadline)
+
+
+def wide_log(records=20):
+    """NDJSON lines with 40 objects of 40 fields each, nested under two more levels"""
+    lines = []
+    for i in range(records):
+        profile = {f"field{f}": {f"sub{g}": f"value {i} " * 20 for g in range(40)} for f in range(40)}
+        lines.append(json.dumps({"user": {"profile": profile}, "deep": nested(9)}))
+    return ("\n".join(lines) + "\n").encode()
+
+
+def document_nodes(value):
+    return sum(1 + document_nodes(child) for child in value.values()) if isinstance(value, dict) else 0
+
+
+def document_depth(value):
+    return 1 + max(map(document_depth, value.values())) if isinstance(value, dict) and value else 0
+
+
+class SchemaDocumentTests(SimpleTestCase):
+    def test_wide_log_is_bounded(self):
+        document = schema.SchemaAggregator().add_lines(wide_log().splitlines()).to_document()
+        self.assertEqual(document_nodes(document), schema.MAX_DOCUMENT_NODES)
+        self.assertLessEqual(document_depth(document), schema.MAX_DOCUMENT_DEPTH + 1)
+        self.assertTrue(validate_json(document))
+        profile = document["user ×20"]["profile ×20"]
+        self.assertIn("field0 ×20", profile)
+        self.assertIn(schema.MORE_FIELDS, json.dumps(document))
+
+    def test_clipped_keys_stay_distinct(self):
+        aggregator = schema.SchemaAggregator()
+        aggregator.add({"k" * 60 + str(i): "v" * 60 for i in range(3)})
+        document = aggregator.to_document()
+        self.assertEqual(len(document), 3)
+        for label, value in document.items():
+            self.assertLessEqual(len(label), schema.MAX_SAMPLE_LENGTH + 5)
+            self.assertTrue(value.endswith("e.g. " + "v" * schema.MAX_SAMPLE_LENGTH))
+
+
+class NdjsonViewTests(TestCase):
+    url = "/api/process-json/?render=client"
+
+    def setUp(self):
+        self.client = Client(HTTP_ORIGIN="http://localhost:3000")
+
+    def test_ndjson_body(self):
+        response = self.client.post(self.url, data=ndjson_lines(50), content_type="application/x-ndjson")
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body["schema"], {"records": 49, "invalid_lines": 1})
+        self.assertIn("user ×", body["mermaid_code"])
+
+    def test_jsonl_upload(self):
+        upload = SimpleUploadedFile("events.jsonl", ndjson_lines(50), content_type="application/octet-stream")
+        response = self.client.post(self.url, {"file": upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["schema"]["records"], 49)
+
+    def test_wide_log(self):
+        response = self.client.post(self.url, data=wide_log(), content_type="application/x-ndjson")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["schema"]["records"], 20)
+
+    def test_no_records(self):
+        response = self.client.post(self.url, data=b"\n\n", content_type="application/x-ndjson")
+        self.assertEqual(response.status_code, 400)
+
+    def test_deadline_returns_504(self):
+        response = self.client.post(
+            self.url,
+            data=ndjson_lines(3000),
+            content_type="application/x-ndjson",
+            headers={"X-Request-Timeout": "0.000001"},
+        )
+        self.assertEqual(response.status_code, 504)
+
+
+class DeadlineTests(SimpleTestCase):
+    def test_remaining_time(self):
+        deadline = Deadline(10)
+        self.assertTrue(9 < deadline.remaining() <= 10)
+        self.assertTrue(deadline.allows(5))
+        self.assertFalse(deadline.allows(11))
+        self.assertEqual(deadline.timeout(3), 3)
+        self.assertLessEqual(Deadline(0.5).timeout(3), 0.5)
+        self.assertEqual(remaining_or(None, 10), 10)
+        self.assertLessEqual(remaining_or(Deadline(1), 10), 1)
+
+    def test_cancel_and_expiry(self):
+        deadline = Deadline(10)
+        deadline.cancel()
+        self.assertTrue(deadline.cancelled)
+        self.assertEqual(deadline.remaining(), 0)
+        self.assertTrue(deadline.expired())
+        self.assertTrue(Deadline(0).expired())
+
+    def test_request_deadline_header(self):
+        from langgraph_app.config import REQUEST_TIMEOUT
+        from .views import request_deadline
+
+        factory = RequestFactory()
+        cases = {None: REQUEST_TIMEOUT, "5": 5, "1e9": REQUEST_TIMEOUT, "abc": REQUEST_TIMEOUT, "0": REQUEST_TIMEOUT, "-1": REQUEST_TIMEOUT}
+        for header, seconds in cases.items():
+            headers = {"X-Request-Timeout": header} if header is not None else {}
+            remaining = request_deadline(factory.post("/", headers=headers)).remaining()
+            self.assertTrue(seconds - 1 < remaining <= seconds, f"{header!r} gave {remaining}")
+
+    def test_deadline_stop(self):
+        from langgraph_app.agent import deadline_stop
+
+        self.assertIsNone(deadline_stop({"deadline": Deadline(10)}, "render_diagram"))
+        stop = deadline_stop({"deadline": Deadline(0)}, "render_diagram")
+        self.assertEqual(stop["error_node"], "render_diagram")
+        self.assertTrue(stop["timed_out"])
+        self.assertIn("too long", stop["error"])
+        cancelled = Deadline(10)
+        cancelled.cancel()
+        self.assertIn("cancelled", deadline_stop({"deadline": cancelled}, "validate")["error"])
+        # An earlier error is kept rather than replaced
+        self.assertEqual(deadline_stop({"deadline": Deadline(0), "error": "bad"}, "render_diagram"), {})
+
+
+def http_response(status_code, text="<svg>diagram</svg>"):
+    return mock.Mock(status_code=status_code, text=text)
+
+
+class RenderDeadlineTests(SimpleTestCase):
+    def render(self, deadline, get_status=200, on_get=None):
+        def get(*args, **kwargs):
+            if on_get is not None:
+                on_get()
+            return http_response(get_status)
+
+        with mock.patch("requests.get", side_effect=get) as get_mock, \
+                mock.patch("requests.post", return_value=http_response(200, "<svg>fallback</svg>")) as post_mock:
+            svg = generate_svg_from_mermaid("graph TD\n    A --> B", deadline)
+        return svg, get_mock, post_mock
+
+    def test_timeouts_are_capped_to_the_deadline(self):
+        svg, get, post = self.render(Deadline(4), get_status=500)
+        self.assertEqual(svg, "<svg>fallback</svg>")
+        self.assertLessEqual(get.call_args.kwargs["timeout"], 4)
+        self.assertLessEqual(post.call_args.kwargs["timeout"], 4)
+
+    def test_without_deadline_timeouts_are_ten_seconds(self):
+        svg, get, post = self.render(None)
+        self.assertEqual(svg, "<svg>diagram</svg>")
+        self.assertEqual(get.call_args.kwargs["timeout"], 10)
+        post.assert_not_called()
+
+    def test_services_are_skipped_without_time_left(self):
+        svg, get, post = self.render(Deadline(0.5))
+        get.assert_not_called()
+        post.assert_not_called()
+        self.assertTrue(is_fallback_svg(svg))
+
+    def test_fallback_service_is_skipped_once_time_runs_out(self):
+        deadline = Deadline(10)
+        svg, get, post = self.render(deadline, get_status=500, on_get=deadline.cancel)
+        get.assert_called_once()
+        post.assert_not_called()
+        self.assertTrue(is_fallback_svg(svg))
+
+
+class GenerateDiagramDeadlineTests(TestCase):
+    def test_missed_deadline_returns_504(self):
+        client = Client(HTTP_ORIGIN="http://localhost:3000")
+        with mock.patch("langgraph_app.agent.generate_svg_from_mermaid") as render:
+            response = client.post(
+                "/api/generate-diagram/",
+                data={"a": 1},
+                content_type="application/json",
+                headers={"X-Request-Timeout": "0.000001"},
+            )
+        self.assertEqual(response.status_code, 504)
+        self.assertFalse(response.json()["success"])
+        render.assert_not_called()
+
+
+def temporary_profile_dir(test):
+    """Point PROFILE_DIR at a new, empty directory for the rest of the test"""
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    test.enterContext(test.settings(PROFILE_DIR=Path(directory.name)))
+    return Path(directory.name)
+
+
+def partitioned_result():
+    pages = [
+        {"id": "page-0", "title": "Overview", "mermaid_code": "graph TD\n    A", "diagram_image": "<svg>overview</svg>"},
+        {"id": "page-1", "title": "a", "mermaid_code": "graph TD\n    B", "diagram_image": "<svg>same</svg>"},
+        {"id": "page-2", "title": "b", "mermaid_code": "graph TD\n    C", "diagram_image": "<svg>same</svg>"},
+    ]
+    return {"success": True, "mermaid_code": "graph TD\n    A", "diagram_image": "<svg>overview</svg>", "pages": pages}
+
+
+class PageStorageTests(TestCase):
+    def test_pages_are_stored_as_blobs(self):
+        from .models import Blob, Diagram
+
+        result = partitioned_result()
+        diagram = Diagram.objects.record("doc", result, "partition@200")
+        manifest = diagram.pages.text()
+        self.assertNotIn("<svg>", manifest)
+        self.assertNotIn("graph TD", manifest)
+        # Mermaid for 3 pages, 2 distinct page SVGs, and the manifest; the overview is shared
+        self.assertEqual(Blob.objects.count(), 6)
+        self.assertEqual(Diagram.objects.lookup("doc", "partition@200"), result)
+
+    def test_compaction_keeps_page_blobs(self):
+        from django.core.management import call_command
+        from .models import Blob, Diagram
+
+        temporary_profile_dir(self)
+        Diagram.objects.record("doc", partitioned_result(), "partition@200")
+        Blob.objects.store("unused")
+        call_command("compact_diagrams", stdout=io.StringIO())
+        self.assertEqual(Blob.objects.count(), 6)
+        self.assertEqual(Diagram.objects.lookup("doc", "partition@200"), partitioned_result())
+
+
+def pipeline_result(svg="<svg>diagram</svg>"):
+    return {"success": True, "mermaid_code": "graph TD\n    A --> B", "diagram_image": svg}
+
+
+class DiagramStoreTests(TestCase):
+    def setUp(self):
+        self.client = Client(HTTP_ORIGIN="http://localhost:3000")
+        patcher = mock.patch("api.views.process_with_langgraph", side_effect=self.run_pipeline)
+        self.pipeline = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.svg = "<svg>diagram</svg>"
+
+    async def run_pipeline(self, *args, **kwargs):
+        return pipeline_result(self.svg)
+
+    def generate(self, document):
+        response = self.client.post("/api/generate-diagram/", data=document, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_hit_skips_the_workflow(self):
+        from .models import Diagram
+
+        first = self.generate({"b": 1, "a": [1, 2]})
+        # Key order doesn't change the canonical hash
+        second = self.generate({"a": [1, 2], "b": 1})
+        self.assertEqual(self.pipeline.call_count, 1)
+        self.assertEqual(first, second)
+        self.assertEqual(Diagram.objects.get().hits, 1)
+
+    def test_identical_outputs_share_blobs(self):
+        from .models import Blob, Diagram
+
+        self.generate({"a": 1})
+        self.generate({"a": 2})
+        self.assertEqual(Diagram.objects.count(), 2)
+        # One Mermaid blob and one SVG blob for both documents
+        self.assertEqual(Blob.objects.count(), 2)
+
+    def test_fallback_svgs_are_not_recorded(self):
+        from .models import Diagram
+
+        self.svg = "<svg><text>JSON Visualization (rendering services unavailable)</text></svg>"
+        self.generate({"a": 1})
+        self.generate({"a": 1})
+        self.assertEqual(Diagram.objects.count(), 0)
+        self.assertEqual(self.pipeline.call_count, 2)
+
+    def test_database_errors_fall_back_to_the_pipeline(self):
+        from django.db import DatabaseError
+        from .models import Diagram
+
+        with mock.patch.object(Diagram.objects, "lookup", side_effect=DatabaseError), \
+                mock.patch.object(Diagram.objects, "record", side_effect=DatabaseError), \
+                self.assertLogs("api.views", "ERROR"):
+            body = self.generate({"a": 1})
+        self.assertEqual(body["mermaid_code"], pipeline_result()["mermaid_code"])
+        self.assertEqual(self.pipeline.call_count, 1)
+
+
+class DiagramHistoryTests(TestCase):
+    def setUp(self):
+        from .models import Diagram
+
+        self.client = Client(HTTP_ORIGIN="http://localhost:3000")
+        self.diagrams = [Diagram.objects.record(f"doc{i}", pipeline_result(f"<svg>{i}</svg>")) for i in range(3)]
+
+    def test_pagination(self):
+        first = self.client.get("/api/history/?page_size=2").json()
+        self.assertEqual((first["count"], first["page"], first["num_pages"]), (3, 1, 2))
+        second = self.client.get("/api/history/?page_size=2&page=2").json()
+        self.assertEqual((len(first["results"]), len(second["results"])), (2, 1))
+        hashes = {result["document_hash"] for result in first["results"] + second["results"]}
+        self.assertEqual(hashes, {"doc0", "doc1", "doc2"})
+
+    def test_invalid_page_size(self):
+        response = self.client.get("/api/history/?page_size=many")
+        self.assertEqual(response.status_code, 400)
+
+    def test_detail(self):
+        diagram = self.diagrams[1]
+        body = self.client.get(f"/api/history/{diagram.id}/").json()
+        self.assertEqual(body["document_hash"], "doc1")
+        self.assertEqual(body["mermaid_code"], pipeline_result()["mermaid_code"])
+        self.assertEqual(body["diagram_image"], "<svg>1</svg>")
+        self.assertNotIn("pages", body)
+        self.assertEqual(self.client.get("/api/history/999/").status_code, 404)
+
+
+class CompactDiagramsTests(TestCase):
+    def setUp(self):
+        from django.utils import timezone
+        from .models import Diagram
+
+        self.profile_dir = temporary_profile_dir(self)
+        self.old = Diagram.objects.record("old", pipeline_result("<svg>old</svg>"))
+        self.new = Diagram.objects.record("new", pipeline_result("<svg>new</svg>"))
+        Diagram.objects.filter(pk=self.old.pk).update(created_at=timezone.now() - timedelta(days=60))
+
+    def test_expired_diagrams_and_orphan_blobs_are_deleted(self):
+        from django.core.management import call_command
+        from .models import Blob, Diagram
+
+        call_command("compact_diagrams", "--days", "30", stdout=io.StringIO())
+        self.assertEqual(list(Diagram.objects.values_list("document_hash", flat=True)), ["new"])
+        # The Mermaid blob is shared with the remaining diagram; only the old SVG goes
+        self.assertEqual(
+            sorted(blob.text() for blob in Blob.objects.all()),
+            sorted([pipeline_result()["mermaid_code"], "<svg>new</svg>"]),
+        )
+
+    def test_dry_run_changes_nothing(self):
+        from django.core.management import call_command
+        from .models import Blob, Diagram
+
+        out = io.StringIO()
+        call_command("compact_diagrams", "--dry-run", stdout=out)
+        self.assertIn("Would delete 1 diagram", out.getvalue())
+        self.assertEqual(Diagram.objects.count(), 2)
+        self.assertEqual(Blob.objects.count(), 3)
+
+    def test_old_profiles_are_deleted(self):
+        from django.core.management import call_command
+
+        old, new = self.profile_dir / "a.pstats", self.profile_dir / "b.collapsed"
+        for path in (old, new):
+            path.write_text("")
+        ten_days_ago = time.time() - 10 * 24 * 60 * 60
+        os.utime(old, (ten_days_ago, ten_days_ago))
+        out = io.StringIO()
+        call_command("compact_diagrams", "--dry-run", stdout=out)
+        self.assertIn("Would delete 1 profile file", out.getvalue())
+        self.assertTrue(old.exists())
+        call_command("compact_diagrams", "--profile-days", "7", stdout=io.StringIO())
+        self.assertFalse(old.exists())
+        self.assertTrue(new.exists())
+
+
+@override_settings(PROFILE_TOKEN="secret", PROFILE_SAMPLE_RATE=0)
+class ProfilingTests(TestCase):
+    def setUp(self):
+        self.profile_dir = temporary_profile_dir(self)
+        self.client = Client(HTTP_ORIGIN="http://localhost:3000")
+
+    def generate(self, token=None):
+        headers = {"X-Flow-Profile": token} if token is not None else {}
+        with mock.patch("langgraph_app.agent.generate_svg_from_mermaid", return_value="<svg>diagram</svg>"):
+            response = self.client.post("/api/generate-diagram/", data={"a": 1}, content_type="application/json", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_server_timing(self):
+        response = self.generate()
+        names = [entry.split(";")[0] for entry in response["Server-Timing"].split(", ")]
+        for name in ("view", "validate", "generate_mermaid", "render_diagram", "render"):
+            self.assertIn(name, names)
+        self.assertRegex(response["Server-Timing"], r"\bview;dur=\d+\.\d\b")
+        self.assertNotIn("X-Flow-Profile-Id", response)
+
+    def test_token_triggers_a_profile(self):
+        response = self.generate("secret")
+        profile_id = response["X-Flow-Profile-Id"]
+        self.assertTrue((self.profile_dir / f"{profile_id}.pstats").is_file())
+        self.assertTrue((self.profile_dir / f"{profile_id}.collapsed").is_file())
+
+    def test_wrong_or_non_ascii_token_does_not(self):
+        for token in ("wrong", "sécret", "秘密"):
+            response = self.generate(token)
+            self.assertNotIn("X-Flow-Profile-Id", response)
+        self.assertEqual(list(self.profile_dir.iterdir()), [])
+
+    def test_download(self):
+        profile_id = self.generate("secret")["X-Flow-Profile-Id"]
+        url = f"/api/profiles/{profile_id}.collapsed"
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.get(url, headers={"X-Flow-Profile": "wrong"}).status_code, 403)
+        response = self.client.get(url, headers={"X-Flow-Profile": "secret"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            b"".join(response.streaming_content),
+            (self.profile_dir / f"{profile_id}.collapsed").read_bytes(),
+        )
+        missing = self.client.get(f"/api/profiles/{'0' * 32}.pstats", headers={"X-Flow-Profile": "secret"})
+        self.assertEqual(missing.status_code, 404)
+
+
+class ClientRenderTests(TestCase):
+    def setUp(self):
+        self.client = Client(HTTP_ORIGIN="http://localhost:3000")
+        patcher = mock.patch("langgraph_app.agent.generate_svg_from_mermaid")
+        self.render = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assertClientRendered(self, response, mode):
+        from .models import Diagram
+
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body["mermaid_code"], parse_json_to_mermaid(SAMPLE, compact="compact" in mode))
+        # No SVG at all: neither a rendered one nor ProcessJsonView's placeholder
+        self.assertEqual(body["diagram_image"], "")
+        self.render.assert_not_called()
+        diagram = Diagram.objects.get()
+        self.assertEqual(diagram.mode, mode)
+        self.assertIsNone(diagram.svg)
+
+    def test_generate_diagram(self):
+        response = self.client.post("/api/generate-diagram/?render=client", data=SAMPLE, content_type="application/json")
+        self.assertClientRendered(response, "client")
+
+    def test_process_json_upload(self):
+        upload = SimpleUploadedFile("sample.json", json.dumps(SAMPLE).encode(), content_type="application/json")
+        response = self.client.post("/api/process-json/?render=client&compact=1", {"file": upload})
+        self.assertClientRendered(response, "compact+client")
+
+    def test_stored_client_result_is_not_served_to_server_render(self):
+        self.client.post("/api/generate-diagram/?render=client", data=SAMPLE, content_type="application/json")
+        self.render.return_value = "<svg>diagram</svg>"
+        response = self.client.post("/api/generate-diagram/", data=SAMPLE, content_type="application/json")
+        self.assertEqual(response.json()["diagram_image"], "<svg>diagram</svg>")
+        self.render.assert_called_once()
@@ -1,8 +1,20 @@
-from django.urls import path
-from .views import GenerateDiagramView, HomeView, ProcessJsonView
+from django.urls import path, re_path
+from .views import (
+    DiagramDetailView,
+    DiagramHistoryView,
+    GenerateDiagramView,
+    HomeView,
+    ProcessJsonView,
+    ProfileDownloadView,
+    StreamMermaidView,
+)
 
 urlpatterns = [
     path('', HomeView.as_view(), name='home'),
     path('generate-diagram/', GenerateDiagramView.as_view(), name='generate_diagram'),
     path('process-json/', ProcessJsonView.as_view(), name='process_json'),
+    path('stream-mermaid/', StreamMermaidView.as_view(), name='stream_mermaid'),
+    path('history/', DiagramHistoryView.as_view(), name='diagram_history'),
+    path('history/<int:diagram_id>/', DiagramDetailView.as_view(), name='diagram_detail'),
+    re_path(r'^profiles/(?P<profile_id>[0-9a-f]{32})\.(?P<kind>pstats|collapsed)$', ProfileDownloadView.as_view(), name='profile_download'),
 ] 
\ No newline at end of file
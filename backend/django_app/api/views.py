@@ -1,14 +1,23 @@
 from django.shortcuts import render
 import json
-from django.http import JsonResponse, HttpResponse
+from django.conf import settings
+from django.http import FileResponse, JsonResponse, HttpResponse, StreamingHttpResponse
+from django.core.paginator import Paginator
+from django.db import DatabaseError
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from django.views import View
 import requests
 from mermaid import Mermaid
 import asyncio
-from typing import Dict, Any
+import itertools
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from typing import AsyncIterator, Dict, Any, Iterator, Optional
 import logging
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from .middleware import has_profile_token
+from .models import Diagram
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -36,31 +45,164 @@ class HomeView(View):
                 <div class="endpoint">
                     <p><strong>POST /api/process-json/</strong> - Process JSON file for diagram generation</p>
                 </div>
+                <div class="endpoint">
+                    <p><strong>POST /api/stream-mermaid/</strong> - Stream Mermaid code line by line as it is generated</p>
+                </div>
+                <div class="endpoint">
+                    <p><strong>GET /api/history/</strong> - List previously generated diagrams (<code>?page=</code>, <code>?page_size=</code>)</p>
+                </div>
+                <div class="endpoint">
+                    <p><strong>GET /api/history/&lt;id&gt;/</strong> - Fetch a previously generated diagram</p>
+                </div>
+                <div class="endpoint">
+                    <p><strong>GET /api/profiles/&lt;id&gt;.pstats|collapsed</strong> - Download a request profile (needs the <code>X-Flow-Profile</code> token)</p>
+                </div>
+                <p>Add <code>?compact=1</code> to the POST endpoints for shorter Mermaid code (short IDs, merged key/value nodes, class-based styling).</p>
+                <p><code>/api/process-json/</code> also accepts NDJSON / JSON lines (a <code>.ndjson</code> or <code>.jsonl</code> upload, or an <code>application/x-ndjson</code> body) and diagrams the schema aggregated over all records.</p>
+                <p>Add <code>?partition=1</code> to the diagram endpoints to split large documents into linked pages, returned as a <code>pages</code> manifest.</p>
+                <p>Add <code>?render=client</code> to the diagram endpoints to skip server-side rendering: only the Mermaid code is returned, for the client to render with mermaid.js.</p>
                 <p>The React frontend should be running on <a href="http://localhost:3000">http://localhost:3000</a></p>
             </body>
         </html>
         """)
 
-def process_with_langgraph(json_data: Dict[Any, Any]) -> Dict[str, Any]:
+async def process_with_langgraph(
+    json_data: Optional[Dict[Any, Any]],
+    raw_json: Optional[bytes] = None,
+    compact: bool = False,
+    partition: bool = False,
+    deadline=None,
+    client_render: bool = False,
+    offloaded: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
     """
     Process JSON data with LangGraph agent and return the result.
     
     Args:
         json_data: The JSON data to process
+        raw_json: The request bytes json_data was parsed from, if available
+        compact: Whether to generate compact Mermaid code
+        partition: Whether to split large documents into linked pages
+        deadline: The request's Deadline, see request_deadline()
+        client_render: Whether to skip SVG rendering and return Mermaid code only
+        offloaded: The process pool's result, if the document was already processed there
         
     Returns:
         A dictionary with the processing result
     """
     from langgraph_app.agent import process_json_with_agent
     
-    # Run the async function in a synchronous context
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+    return await process_json_with_agent(json_data, raw_json, compact, partition, deadline, client_render, offloaded)
+
+async def process_with_store(
+    json_data: Optional[Dict[Any, Any]],
+    raw_json: Optional[bytes] = None,
+    compact: bool = False,
+    partition: bool = False,
+    deadline=None,
+    client_render: bool = False,
+) -> Dict[str, Any]:
+    """
+    Answer from the diagram store when this document has been processed
+    before, otherwise run the LangGraph pipeline and store the result.
+    The store is only a cache: if it is unavailable, requests are
+    processed as if it were empty.
+    
+    With json_data None, the document is parsed, hashed and converted
+    from raw_json in the process pool, off the event loop.
+    """
+    from langgraph_app.agent import offload_document
+    from langgraph_app.config import PARTITION_NODE_BUDGET
+    from langgraph_app.tools import canonical_hash, is_fallback_svg
+    
+    offloaded = None
+    if json_data is None:
+        offloaded = await sync_to_async(offload_document, thread_sensitive=False)(raw_json, compact, partition, deadline)
+        document_hash = offloaded.get("document_hash")
+    else:
+        document_hash = canonical_hash(json_data)
+    # Pages depend on the node budget, so stored manifests are only reused for the same budget
+    flags = (("compact", compact), (f"partition@{PARTITION_NODE_BUDGET}", partition), ("client", client_render))
+    mode = "+".join(name for name, enabled in flags if enabled) or "default"
+    cached = None
+    if document_hash is not None:
+        try:
+            cached = await sync_to_async(Diagram.objects.lookup)(document_hash, mode)
+        except DatabaseError:
+            logger.exception("Diagram store lookup failed")
+    if cached is not None:
+        return cached
+    
+    result = await process_with_langgraph(json_data, raw_json, compact, partition, deadline, client_render, offloaded)
+    
+    # Placeholder SVGs mean rendering failed; don't keep them around
+    svgs = [result.get("diagram_image", "")] + [page.get("diagram_image", "") for page in result.get("pages", [])]
+    if document_hash is not None and result.get("success", False) and not any(is_fallback_svg(svg) for svg in svgs):
+        try:
+            await sync_to_async(Diagram.objects.record)(document_hash, result, mode)
+        except DatabaseError:
+            logger.exception("Could not record diagram in the store")
+    
+    return result
+
+def parse_request_json(raw_json: bytes) -> Optional[Dict[Any, Any]]:
+    """
+    Parse a request's JSON, or return None for documents large enough to
+    be parsed in the process pool instead, see process_with_store().
+    """
+    from langgraph_app.pool import should_offload
+    
+    if should_offload(raw_json):
+        return None
+    return json.loads(raw_json)
+
+def request_deadline(request):
+    """
+    Deadline for a diagram request: REQUEST_TIMEOUT seconds, or fewer
+    if the client asks for that with an X-Request-Timeout header.
+    """
+    from langgraph_app.config import REQUEST_TIMEOUT
+    from langgraph_app.deadline import Deadline
+    
+    seconds = REQUEST_TIMEOUT
     try:
-        result = loop.run_until_complete(process_json_with_agent(json_data))
-        return result
-    finally:
-        loop.close()
+        requested = float(request.headers.get("X-Request-Timeout", ""))
+        if requested > 0:
+            seconds = min(seconds, requested)
+    except ValueError:
+        pass
+    return Deadline(seconds)
+
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/jsonl", "application/x-jsonlines")
+NDJSON_EXTENSIONS = (".ndjson", ".jsonl")
+
+def is_ndjson(request, file=None) -> bool:
+    """Whether an upload, or else the request body, holds one JSON record per line"""
+    if file is not None:
+        return file.name.lower().endswith(NDJSON_EXTENSIONS) or file.content_type in NDJSON_CONTENT_TYPES
+    return request.content_type in NDJSON_CONTENT_TYPES
+
+def aggregate_ndjson(source, deadline):
+    """
+    Fold NDJSON records into a schema summary line by line, without holding
+    the input in memory. Uploads spooled to disk are split into byte ranges
+    and aggregated in the process pool. Raises TimeoutError once the
+    deadline passes or the request is cancelled.
+    """
+    from langgraph_app.config import POOL_SIZE
+    from langgraph_app.schema import SchemaAggregator, aggregate_ndjson_file
+    
+    if hasattr(source, "temporary_file_path"):
+        return aggregate_ndjson_file(source.temporary_file_path(), POOL_SIZE, deadline)
+    return SchemaAggregator().add_lines(source, deadline)
+
+def wants_client_render(request) -> bool:
+    """?render=client: skip server rendering and return only the Mermaid code"""
+    return request.GET.get("render", "server").lower() == "client"
+
+def query_flag(request, name: str) -> bool:
+    """Read a boolean query parameter such as ?compact=1"""
+    return request.GET.get(name, "").lower() in ("1", "true", "yes")
 
 def check_origin(request):
     """
@@ -89,7 +231,9 @@ def check_origin(request):
 
 @method_decorator(csrf_exempt, name='dispatch')
 class GenerateDiagramView(View):
-    def post(self, request):
+    async def post(self, request):
+        deadline = request_deadline(request)
+        client_render = wants_client_render(request)
         try:
             # Security check for allowed origins
             if not check_origin(request):
@@ -100,23 +244,39 @@ class GenerateDiagramView(View):
                 }, status=403)
             
             # Parse the JSON data from the request body
-            data = json.loads(request.body)
+            raw_json = request.body
+            data = parse_request_json(raw_json)
             
-            # Process with LangGraph
-            result = process_with_langgraph(data)
+            # Process with LangGraph, or answer from the store
+            result = await process_with_store(
+                data,
+                raw_json,
+                compact=query_flag(request, 'compact'),
+                partition=query_flag(request, 'partition'),
+                deadline=deadline,
+                client_render=client_render,
+            )
             
             if not result.get("success", False):
                 return JsonResponse({
                     "success": False,
                     "error": result.get("error", "Unknown error")
-                }, status=400)
+                }, status=504 if result.get("timed_out") else 400)
             
-            return JsonResponse({
+            response_data = {
                 "success": True,
                 "mermaid_code": result.get("mermaid_code", ""),
                 "diagram_image": result.get("diagram_image", "")
-            })
+            }
+            if "pages" in result:
+                response_data["pages"] = result["pages"]
+            
+            return JsonResponse(response_data)
         
+        except asyncio.CancelledError:
+            # The client disconnected: stop work still running in other threads
+            deadline.cancel()
+            raise
         except Exception as e:
             logger.error(f"Error in GenerateDiagramView: {str(e)}", exc_info=True)
             return JsonResponse({
@@ -126,7 +286,9 @@ class GenerateDiagramView(View):
 
 @method_decorator(csrf_exempt, name='dispatch')
 class ProcessJsonView(View):
-    def post(self, request):
+    async def post(self, request):
+        deadline = request_deadline(request)
+        client_render = wants_client_render(request)
         try:
             # Security check for allowed origins
             if not check_origin(request):
@@ -136,32 +298,55 @@ class ProcessJsonView(View):
                     "error": "Unauthorized origin"
                 }, status=403)
             
+            file = request.FILES.get('file')
+            schema = None
+            if is_ndjson(request, file):
+                # JSON lines: diagram the aggregated schema of all records
+                aggregator = await sync_to_async(aggregate_ndjson, thread_sensitive=False)(
+                    file if file is not None else request, deadline
+                )
+                if not aggregator.records:
+                    return JsonResponse({"error": "No JSON records found"}, status=400)
+                data = aggregator.to_document()
+                raw_json = None
+                schema = aggregator.summary()
             # Check if the request has a file
-            if 'file' in request.FILES:
-                file = request.FILES['file']
+            elif file is not None:
                 # Read and parse JSON file
-                json_content = file.read().decode('utf-8')
-                data = json.loads(json_content)
+                raw_json = file.read()
+                data = parse_request_json(raw_json)
             else:
                 # Try to parse the body as JSON
-                data = json.loads(request.body)
+                raw_json = request.body
+                data = parse_request_json(raw_json)
             
-            # Process with LangGraph
-            result = process_with_langgraph(data)
+            # Process with LangGraph, or answer from the store
+            result = await process_with_store(
+                data,
+                raw_json,
+                compact=query_flag(request, 'compact'),
+                partition=query_flag(request, 'partition'),
+                deadline=deadline,
+                client_render=client_render,
+            )
             
             if not result.get("success", False):
                 return JsonResponse({
                     "error": result.get("error", "Unknown error")
-                }, status=400)
+                }, status=504 if result.get("timed_out") else 400)
             
             # Return the mermaid code and SVG diagram
             response_data = {
                 "mermaid_code": result.get("mermaid_code", ""),
                 "diagram_image": result.get("diagram_image", "")
             }
+            if "pages" in result:
+                response_data["pages"] = result["pages"]
+            if schema is not None:
+                response_data["schema"] = schema
             
             # If there's no diagram_image but we have mermaid_code, generate a fallback message
-            if not response_data["diagram_image"] and response_data["mermaid_code"]:
+            if not response_data["diagram_image"] and response_data["mermaid_code"] and not client_render:
                 response_data["diagram_image"] = f"""<svg xmlns="http://www.w3.org/2000/svg" width="500" height="200">
                     <rect width="100%" height="100%" fill="#f8f9fa" />
                     <text x="50%" y="80" font-family="Arial" font-size="16" text-anchor="middle">
@@ -174,8 +359,140 @@ class ProcessJsonView(View):
             
             return JsonResponse(response_data)
             
+        except asyncio.CancelledError:
+            # The client disconnected: stop work still running in other threads
+            deadline.cancel()
+            raise
+        except (TimeoutError, FuturesTimeoutError):
+            # NDJSON aggregation ran past the request's deadline
+            return JsonResponse({
+                "error": "The file took too long to process. Please try a smaller file."
+            }, status=504)
         except json.JSONDecodeError:
             return JsonResponse({"error": "Invalid JSON file"}, status=400)
         except Exception as e:
             logger.error(f"Error in ProcessJsonView: {str(e)}", exc_info=True)
             return JsonResponse({"error": f"Error processing request: {str(e)}"}, status=400)
+
+
+# Lines of Mermaid code generated per worker thread hop when streaming under ASGI
+STREAM_CHUNK_LINES = 64
+
+def _next_chunk(lines: Iterator[str], size: int) -> str:
+    return "".join(itertools.islice(lines, size))
+
+async def stream_chunks(lines: Iterator[str], size: int = STREAM_CHUNK_LINES) -> AsyncIterator[str]:
+    """
+    Async iterator over a sync line generator. ASGI buffers a sync
+    streaming iterator completely before sending anything, so this hands
+    out chunks as they are generated, each produced in a worker thread
+    to keep the event loop free.
+    """
+    while True:
+        chunk = await sync_to_async(_next_chunk, thread_sensitive=False)(lines, size)
+        if not chunk:
+            return
+        yield chunk
+
+@method_decorator(csrf_exempt, name='dispatch')
+class StreamMermaidView(View):
+    """
+    Stream the Mermaid code for a JSON document as plain text.
+
+    Lines are sent to the client as the generator produces them, so the
+    response starts immediately and the full diagram is never held in memory.
+    Rendering is left to the client.
+    """
+    def post(self, request):
+        from langgraph_app.tools import iter_json_to_mermaid, validate_json
+        
+        try:
+            # Security check for allowed origins
+            if not check_origin(request):
+                logger.warning(f"Rejected request from unauthorized origin: {request.META.get('HTTP_ORIGIN', '')} / {request.META.get('HTTP_REFERER', '')}")
+                return JsonResponse({
+                    "error": "Unauthorized origin"
+                }, status=403)
+            
+            if 'file' in request.FILES:
+                data = json.loads(request.FILES['file'].read().decode('utf-8'))
+            else:
+                data = json.loads(request.body)
+            
+            # Validate up front: once streaming starts the status code is fixed
+            validate_json(data)
+        except json.JSONDecodeError:
+            return JsonResponse({"error": "Invalid JSON file"}, status=400)
+        except Exception as e:
+            logger.error(f"Error in StreamMermaidView: {str(e)}", exc_info=True)
+            return JsonResponse({"error": f"Error processing request: {str(e)}"}, status=400)
+        
+        content = iter_json_to_mermaid(data, compact=query_flag(request, 'compact'))
+        if isinstance(request, ASGIRequest):
+            content = stream_chunks(content)
+        return StreamingHttpResponse(content, content_type="text/plain; charset=utf-8")
+
+
+class DiagramHistoryView(View):
+    """List stored diagrams, newest first"""
+    def get(self, request):
+        if not check_origin(request):
+            return JsonResponse({"error": "Unauthorized origin"}, status=403)
+        
+        try:
+            page_size = min(max(int(request.GET.get("page_size", 20)), 1), 100)
+        except ValueError:
+            return JsonResponse({"error": "page_size must be an integer"}, status=400)
+        
+        paginator = Paginator(Diagram.objects.all(), page_size)
+        page = paginator.get_page(request.GET.get("page", 1))
+        
+        return JsonResponse({
+            "count": paginator.count,
+            "page": page.number,
+            "num_pages": paginator.num_pages,
+            "results": [
+                {
+                    "id": diagram.id,
+                    "document_hash": diagram.document_hash,
+                    "mode": diagram.mode,
+                    "hits": diagram.hits,
+                    "created_at": diagram.created_at.isoformat(),
+                }
+                for diagram in page.object_list
+            ],
+        })
+
+class DiagramDetailView(View):
+    """Return the Mermaid code and SVG of a stored diagram"""
+    def get(self, request, diagram_id):
+        if not check_origin(request):
+            return JsonResponse({"error": "Unauthorized origin"}, status=403)
+        
+        diagram = Diagram.objects.select_related("mermaid", "svg", "pages").filter(pk=diagram_id).first()
+        if diagram is None:
+            return JsonResponse({"error": "Diagram not found"}, status=404)
+        
+        response_data = {
+            "id": diagram.id,
+            "document_hash": diagram.document_hash,
+            "mode": diagram.mode,
+            "created_at": diagram.created_at.isoformat(),
+            "mermaid_code": diagram.mermaid.text(),
+            "diagram_image": diagram.svg.text() if diagram.svg else "",
+        }
+        if diagram.pages_id:
+            response_data["pages"] = diagram.page_list()
+        return JsonResponse(response_data)
+
+class ProfileDownloadView(View):
+    """Download a saved request profile as pstats or collapsed stacks"""
+    def get(self, request, profile_id, kind):
+        if not has_profile_token(request):
+            return JsonResponse({"error": "Profile token required"}, status=403)
+        
+        path = settings.PROFILE_DIR / f"{profile_id}.{kind}"
+        if not path.is_file():
+            return JsonResponse({"error": "Profile not found"}, status=404)
+        
+        return FileResponse(open(path, "rb"), as_attachment=True, filename=path.name)
@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 from pathlib import Path
 import os
 import sys
+from corsheaders.defaults import default_headers
 
 # Add the parent directory to Python's path so we can import langgraph_app
 parent_dir = str(Path(__file__).resolve().parent.parent.parent)
@@ -49,6 +50,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "api.middleware.ProfilingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
@@ -131,8 +133,22 @@ STATIC_URL = "static/"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# Request bodies may be as large as the documents the process pool accepts
+from langgraph_app.config import POOL_MAX_BYTES  # noqa: E402
+DATA_UPLOAD_MAX_MEMORY_SIZE = POOL_MAX_BYTES
+
+# Request profiling
+# Requests with an "X-Flow-Profile: <PROFILE_TOKEN>" header are profiled, as is a
+# random PROFILE_SAMPLE_RATE fraction (0.0 to 1.0) of all requests.
+# Profiles are written to PROFILE_DIR; an empty token disables the header.
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = Path(os.environ.get("PROFILE_DIR", BASE_DIR / "profiles"))
+
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True  # For development only, set specific origins in production
+CORS_ALLOW_HEADERS = (*default_headers, "x-flow-profile", "x-request-timeout")
+CORS_EXPOSE_HEADERS = ["Server-Timing", "X-Flow-Profile-Id"]
 
 # Security settings - uncomment and configure for production
 # CORS_ALLOWED_ORIGINS = [
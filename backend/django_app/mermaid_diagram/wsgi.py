@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mermaid_diagram.settings")
 
 application = get_wsgi_application()
+
+# Start the process pool before serving, so no request waits for workers to spawn
+from langgraph_app.pool import start_pool  # noqa: E402
+
+start_pool()
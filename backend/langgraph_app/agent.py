@@ -1,21 +1,33 @@
-from typing import Dict, List, Tuple, Any, TypedDict, Annotated
+from typing import Dict, List, Optional, Tuple, Any, TypedDict, Annotated
 import json
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 from langchain_core.messages import AnyMessage, HumanMessage, AIMessage
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI
 from langgraph.graph import StateGraph, END
-from .tools import parse_json_to_mermaid, validate_json, generate_svg_from_mermaid
-from .config import OPENAI_API_KEY, DEFAULT_MODEL, TEMPERATURE
+from .tools import parse_json_to_mermaid, partition_json_to_mermaid, validate_json, generate_svg_from_mermaid, is_fallback_svg
+from .config import OPENAI_API_KEY, DEFAULT_MODEL, TEMPERATURE, PARTITION_NODE_BUDGET, RENDER_CONCURRENCY, REQUEST_TIMEOUT
+from .deadline import Deadline
+from .pool import should_offload, generate_mermaid_offloaded
+from .profiling import profiled, section
 
 # Define state schema
 class AgentState(TypedDict):
     json_data: Dict[Any, Any]
+    raw_json: Optional[bytes]  # Original request bytes, used to offload large documents
+    offloaded: Optional[Dict[str, Any]]  # Result of offload_document() if the caller already ran it
+    compact: bool  # Emit compact Mermaid syntax
+    partition: bool  # Split large documents into linked pages
+    client_render: bool  # Return Mermaid code only; the client renders it
+    deadline: Deadline  # Shared by all nodes; cancelled if the client goes away
     messages: List[AnyMessage]
     valid_json: bool
     mermaid_code: str
     diagram_svg: str
+    pages: List[Dict[str, str]]  # Page manifest when partitioning, overview first
     error: str
     error_node: str  # Track which node produced the error
+    timed_out: bool  # The error is a missed deadline or cancellation
 
 # Initialize LLM
 llm = ChatOpenAI(
@@ -24,50 +36,150 @@ llm = ChatOpenAI(
     openai_api_key=OPENAI_API_KEY
 )
 
+# Error messages shown to the user
+def validation_error(error_message: str) -> AgentState:
+    context = "We couldn't validate your JSON structure. "
+    if "too large" in error_message:
+        context += "The file exceeds our size limits. Please try a smaller JSON file."
+    else:
+        context += "Please check that your JSON is properly formatted."
+    return {"valid_json": False, "error": f"{context} Technical details: {error_message}", "error_node": "validate"}
+
+def generation_error(error_message: str) -> AgentState:
+    context = "We encountered an issue while converting your JSON to a diagram. "
+    if "dict" in error_message or "list" in error_message:
+        context += "Your JSON structure may be too complex or nested too deeply."
+    else:
+        context += "There might be elements in your JSON that we can't properly represent."
+    return {"error": f"{context} Technical details: {error_message}", "error_node": "generate_mermaid"}
+
+def timeout_error(state: AgentState, node: str) -> AgentState:
+    if state["deadline"].cancelled:
+        message = "The request was cancelled before the diagram was finished."
+    else:
+        message = "The diagram took too long to generate. Please try a smaller JSON file or the compact or partitioned modes."
+    return {"error": message, "error_node": node, "timed_out": True}
+
+def deadline_stop(state: AgentState, node: str) -> Optional[AgentState]:
+    """
+    Once the deadline has passed or the request was cancelled, the update
+    a node should return instead of doing work nobody will receive.
+    None means the node should run.
+    """
+    if not state["deadline"].expired():
+        return None
+    if state.get("error"):
+        return {}
+    return timeout_error(state, node)
+
+@profiled("offload")
+def offload_document(raw_json: bytes, compact: bool, partition: bool, deadline: Deadline) -> Dict[str, Any]:
+    """
+    Parse, hash, validate and convert a large document in one trip to the
+    process pool. Returns the pool's result; a missed deadline is reported
+    with "timed_out" rather than raised.
+    """
+    try:
+        return generate_mermaid_offloaded(raw_json, compact, partition, deadline=deadline)
+    except FuturesTimeoutError:
+        return {"error": "Timed out in the process pool", "error_node": "validate", "timed_out": True}
+    except Exception as e:
+        return {"error": str(e), "error_node": "validate"}
+
 # Define nodes
+@profiled("validate")
 def validate(state: AgentState) -> AgentState:
     """Validate the JSON input"""
+    stop = deadline_stop(state, "validate")
+    if stop is not None:
+        return stop
+    
+    # Large documents are validated and converted in one trip to the process pool
+    result = state.get("offloaded")
+    if result is None and should_offload(state.get("raw_json")):
+        result = offload_document(
+            state["raw_json"],
+            state.get("compact", False),
+            state.get("partition", False),
+            state["deadline"],
+        )
+    if result is not None:
+        if result.get("timed_out"):
+            return timeout_error(state, "validate")
+        if result.get("error_node") == "validate":
+            return validation_error(result["error"])
+        if result.get("error_node") == "generate_mermaid":
+            return generation_error(result["error"])
+        return {"valid_json": True, "mermaid_code": result["mermaid_code"], "pages": result.get("pages", [])}
+    
     try:
         valid = validate_json(state["json_data"])
         return {"valid_json": valid}
     except Exception as e:
-        error_message = str(e)
-        context = "We couldn't validate your JSON structure. "
-        if "too large" in error_message:
-            context += "The file exceeds our size limits. Please try a smaller JSON file."
-        else:
-            context += "Please check that your JSON is properly formatted."
-        return {"valid_json": False, "error": f"{context} Technical details: {error_message}", "error_node": "validate"}
+        return validation_error(str(e))
 
+@profiled("generate_mermaid")
 def generate_mermaid(state: AgentState) -> AgentState:
     """Generate Mermaid code from JSON"""
+    stop = deadline_stop(state, "generate_mermaid")
+    if stop is not None:
+        return stop
+    if state.get("error"):
+        return {}
+    if state.get("mermaid_code"):
+        # Already produced by the process pool during validation
+        return {}
     try:
-        mermaid_code = parse_json_to_mermaid(state["json_data"])
+        if state.get("partition"):
+            pages = partition_json_to_mermaid(state["json_data"], PARTITION_NODE_BUDGET, state.get("compact", False))
+            return {"mermaid_code": pages[0]["mermaid_code"], "pages": pages}
+        mermaid_code = parse_json_to_mermaid(state["json_data"], state.get("compact", False))
         return {"mermaid_code": mermaid_code}
     except Exception as e:
-        error_message = str(e)
-        context = "We encountered an issue while converting your JSON to a diagram. "
-        if "dict" in error_message or "list" in error_message:
-            context += "Your JSON structure may be too complex or nested too deeply."
-        else:
-            context += "There might be elements in your JSON that we can't properly represent."
-        return {"error": f"{context} Technical details: {error_message}", "error_node": "generate_mermaid"}
+        return generation_error(str(e))
 
+@profiled("render_diagram")
 def render_diagram(state: AgentState) -> AgentState:
     """Render SVG diagram from Mermaid code"""
+    if state.get("client_render"):
+        return {}
+    stop = deadline_stop(state, "render_diagram")
+    if stop is not None:
+        return stop
+    if state.get("error"):
+        return {}
+    # validate's route and the generate_mermaid edge can both lead here
+    if state.get("diagram_svg"):
+        return {}
+    
+    deadline = state["deadline"]
     try:
         # Our improved generate_svg_from_mermaid always returns an SVG
         # Either a real diagram or a fallback, without raising exceptions
-        svg = generate_svg_from_mermaid(state["mermaid_code"])
+        pages = state.get("pages") or []
+        with section("render"):
+            if pages:
+                # Pages render concurrently, so latency follows the largest page
+                with ThreadPoolExecutor(max_workers=min(len(pages), RENDER_CONCURRENCY)) as executor:
+                    svgs = list(executor.map(
+                        lambda page: generate_svg_from_mermaid(page["mermaid_code"], deadline),
+                        pages,
+                    ))
+                pages = [{**page, "diagram_image": page_svg} for page, page_svg in zip(pages, svgs)]
+                svg = svgs[0]
+            else:
+                svg = generate_svg_from_mermaid(state["mermaid_code"], deadline)
         
         # Check if the SVG is likely a valid diagram (not a fallback or error message)
-        if "Error Generating Diagram" in svg or "rendering services unavailable" in svg:
+        if is_fallback_svg(svg):
             # The SVG is a fallback/error SVG, but we'll still show it to the user
             # Just log a warning
             import logging
             logger = logging.getLogger(__name__)
             logger.warning("Using fallback SVG for diagram rendering")
         
+        if pages:
+            return {"diagram_svg": svg, "pages": pages}
         return {"diagram_svg": svg}
     except Exception as e:
         error_message = str(e)
@@ -87,6 +199,8 @@ def router(state: AgentState) -> str:
         return END
     if not state.get("mermaid_code"):
         return "generate_mermaid"
+    if state.get("client_render"):
+        return END
     if not state.get("diagram_svg"):
         return "render_diagram"
     return END
@@ -116,19 +230,44 @@ def create_agent_workflow():
     return workflow.compile()
 
 # Main agent function to be called from Django
-async def process_json_with_agent(json_data: Dict[Any, Any]) -> Dict[str, Any]:
-    """Process JSON data using the langgraph agent"""
+async def process_json_with_agent(
+    json_data: Dict[Any, Any],
+    raw_json: Optional[bytes] = None,
+    compact: bool = False,
+    partition: bool = False,
+    deadline: Optional[Deadline] = None,
+    client_render: bool = False,
+    offloaded: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    Process JSON data using the langgraph agent.
+    Pass the original request bytes as raw_json to let large documents
+    be processed in the worker pool, compact=True for compact Mermaid, and
+    partition=True to also get a manifest of linked, separately rendered pages.
+    Without a deadline, the request gets REQUEST_TIMEOUT seconds. With
+    client_render=True no SVG is rendered and diagram_image is empty.
+    Callers that already ran offload_document() pass its result as
+    offloaded, with json_data set to None.
+    """
     workflow = create_agent_workflow()
     
     # Initialize state
     initial_state = {
         "json_data": json_data,
+        "raw_json": raw_json,
+        "offloaded": offloaded,
+        "compact": compact,
+        "partition": partition,
+        "client_render": client_render,
+        "deadline": deadline or Deadline(REQUEST_TIMEOUT),
         "messages": [],
         "valid_json": None,
         "mermaid_code": "",
         "diagram_svg": "",
+        "pages": [],
         "error": "",
-        "error_node": ""
+        "error_node": "",
+        "timed_out": False
     }
     
     # Run workflow
@@ -139,11 +278,15 @@ async def process_json_with_agent(json_data: Dict[Any, Any]) -> Dict[str, Any]:
         return {
             "success": False,
             "error": result["error"],
-            "error_node": result.get("error_node", "unknown")
+            "error_node": result.get("error_node", "unknown"),
+            "timed_out": result.get("timed_out", False)
         }
     
-    return {
+    response = {
         "success": True,
         "mermaid_code": result["mermaid_code"],
         "diagram_image": result["diagram_svg"]
     }
+    if result.get("pages"):
+        response["pages"] = result["pages"]
+    return response
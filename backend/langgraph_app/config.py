@@ -44,3 +44,23 @@ TEMPERATURE = float(os.environ.get("TEMPERATURE", "0.1"))
 
 # Agent configuration
 MAX_ITERATIONS = 5
+
+# Process pool configuration
+# Documents larger than POOL_THRESHOLD_BYTES are parsed, validated and converted
+# to Mermaid in a pool of POOL_SIZE worker processes instead of the request thread
+POOL_SIZE = int(os.environ.get("POOL_SIZE", os.cpu_count() or 1))
+POOL_THRESHOLD_BYTES = int(os.environ.get("POOL_THRESHOLD_BYTES", 64 * 1024))
+# Documents on the request thread are limited to 100 KB; the pool takes up to
+# POOL_MAX_BYTES, which is also Django's limit on request bodies
+POOL_MAX_BYTES = int(os.environ.get("POOL_MAX_BYTES", 8 * 1024 * 1024))
+
+# Partitioned diagrams
+# With partitioning requested, documents over PARTITION_NODE_BUDGET nodes are split
+# into linked pages, rendered by up to RENDER_CONCURRENCY parallel requests
+PARTITION_NODE_BUDGET = int(os.environ.get("PARTITION_NODE_BUDGET", 200))
+RENDER_CONCURRENCY = int(os.environ.get("RENDER_CONCURRENCY", 8))
+
+# Request deadline
+# Seconds a diagram request may take end to end; clients can ask for less
+# with an X-Request-Timeout header
+REQUEST_TIMEOUT = float(os.environ.get("REQUEST_TIMEOUT", 30))
@@ -0,0 +1,58 @@
+# Per-request deadlines shared by every stage of the pipeline
+import math
+import threading
+import time
+from typing import Optional
+
+class Deadline:
+    """
+    The point in time by which a request must finish. Also cancelled
+    explicitly, e.g. when the client disconnects, so that stages still
+    running in other threads stop at their next check.
+    """
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+        self._cancelled = threading.Event()
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def remaining(self) -> float:
+        """Seconds left, or 0 once expired or cancelled"""
+        if self.cancelled:
+            return 0.0
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def allows(self, seconds: float) -> bool:
+        """Whether a step needing this many seconds can still finish in time"""
+        return self.remaining() >= seconds
+
+    def timeout(self, cap: float) -> float:
+        """A timeout for one downstream call: cap, unless less time is left"""
+        return min(cap, self.remaining())
+
+class WorkerDeadline(Deadline):
+    """
+    A request's deadline inside a pool worker. An Event can't cross the
+    process boundary, so the request cancels its workers by setting a flag
+    byte in shared memory; buf[index] is that byte.
+    """
+    def __init__(self, seconds: Optional[float], buf: memoryview, index: int):
+        super().__init__(seconds if seconds is not None else math.inf)
+        self._buf = buf
+        self._index = index
+
+    @property
+    def cancelled(self) -> bool:
+        return self._buf[self._index] != 0
+
+def remaining_or(deadline: Optional[Deadline], default: float) -> float:
+    """Timeout for a call that may or may not run under a deadline"""
+    return deadline.timeout(default) if deadline is not None else default
@@ -0,0 +1,177 @@
+# Process pool for the CPU-bound stages of diagram generation
+import atexit
+import json
+import multiprocessing
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, TimeoutError
+from multiprocessing import shared_memory
+from typing import Any, Dict, Optional
+
+from .config import PARTITION_NODE_BUDGET, POOL_MAX_BYTES, POOL_SIZE, POOL_THRESHOLD_BYTES
+from .deadline import Deadline, WorkerDeadline
+from .tools import canonical_hash, iter_json_to_mermaid, partition_json_to_mermaid, validate_json
+
+# Seconds between cancellation checks while a request waits on the pool
+WAIT_SLICE = 0.1
+# Mermaid lines a worker generates between cancellation checks
+CHECK_EVERY_LINES = 1000
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _warm_up() -> None:
+    """No-op task used to start worker processes ahead of the first request"""
+    return None
+
+def create_pool(max_workers: int) -> ProcessPoolExecutor:
+    """
+    Create a process pool with every worker already started.
+    Workers are spawned rather than forked so they don't inherit
+    the server's threads and locks.
+    """
+    pool = ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+    for future in [pool.submit(_warm_up) for _ in range(max_workers)]:
+        future.result()
+    return pool
+
+def get_pool() -> ProcessPoolExecutor:
+    """Return the shared pool, creating it on first use"""
+    global _pool
+    if _pool is not None:
+        return _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = create_pool(POOL_SIZE)
+            atexit.register(shutdown_pool)
+        return _pool
+
+def start_pool() -> None:
+    """
+    Create the shared pool while the server starts, so that no request
+    waits for worker processes to spawn. A no-op when POOL_SIZE is 0.
+    """
+    if POOL_SIZE > 0:
+        get_pool()
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+def should_offload(raw_json: Optional[bytes]) -> bool:
+    """Whether a document is large enough to be worth sending to the pool"""
+    return raw_json is not None and POOL_SIZE > 0 and len(raw_json) > POOL_THRESHOLD_BYTES
+
+def wait_for(future: Future, deadline: Optional[Deadline] = None) -> Any:
+    """
+    Wait for a pool job's result. Under a deadline the wait is split into
+    short slices, so a cancelled request stops waiting within WAIT_SLICE
+    instead of after all the time it had left; TimeoutError is raised once
+    the deadline has passed or the request was cancelled.
+    """
+    if deadline is None:
+        return future.result()
+    while True:
+        try:
+            return future.result(timeout=deadline.timeout(WAIT_SLICE))
+        except TimeoutError:
+            if deadline.expired():
+                raise
+
+def _stopped() -> Dict[str, Any]:
+    return {"error": "Stopped before the request deadline", "error_node": "validate", "timed_out": True}
+
+def _generate_from_shared_memory(
+    name: str,
+    size: int,
+    compact: bool = False,
+    partition: bool = False,
+    timeout: Optional[float] = None,
+) -> Dict[str, Any]:
+    """
+    Worker entry point: parse, hash, validate and convert the document held
+    in the named shared memory block, so the request thread never parses it.
+    The byte after the document is the request's cancellation flag; the
+    worker gives up between stages, and every CHECK_EVERY_LINES lines of
+    Mermaid, once it is set or timeout seconds have passed.
+    Failures are returned rather than raised so the caller can tell which
+    stage they came from.
+    """
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        deadline = WorkerDeadline(timeout, shm.buf, size)
+        try:
+            json_data = json.loads(bytes(shm.buf[:size]))
+        except json.JSONDecodeError as e:
+            return {"error": str(e), "error_node": "validate"}
+        if deadline.expired():
+            return _stopped()
+
+        document_hash = canonical_hash(json_data)
+        try:
+            # The raw size was checked against POOL_MAX_BYTES before the job was submitted
+            validate_json(json_data, max_bytes=None)
+        except Exception as e:
+            return {"document_hash": document_hash, "error": str(e), "error_node": "validate"}
+        if deadline.expired():
+            return _stopped()
+
+        try:
+            if partition:
+                pages = partition_json_to_mermaid(json_data, PARTITION_NODE_BUDGET, compact)
+                return {"document_hash": document_hash, "mermaid_code": pages[0]["mermaid_code"], "pages": pages}
+            lines = []
+            for count, line in enumerate(iter_json_to_mermaid(json_data, compact), 1):
+                lines.append(line)
+                if count % CHECK_EVERY_LINES == 0 and deadline.expired():
+                    return _stopped()
+            return {"document_hash": document_hash, "mermaid_code": "".join(lines)}
+        except Exception as e:
+            return {"document_hash": document_hash, "error": str(e), "error_node": "generate_mermaid"}
+    finally:
+        shm.close()
+
+def generate_mermaid_offloaded(
+    raw_json: bytes,
+    compact: bool = False,
+    partition: bool = False,
+    pool: Optional[Executor] = None,
+    deadline: Optional[Deadline] = None,
+) -> Dict[str, Any]:
+    """
+    Validate raw JSON bytes and convert them to Mermaid code in a worker process.
+
+    The bytes are copied once into shared memory and the worker reads them from
+    there, so the document is never pickled. Returns a dict holding either
+    "mermaid_code" (plus "pages" when partitioning) or "error" and "error_node",
+    and the document's canonical hash as "document_hash" once it parsed.
+    Documents over POOL_MAX_BYTES are rejected without reaching the pool.
+    Raises concurrent.futures.TimeoutError once the deadline passes or the
+    request is cancelled, after setting the flag that stops the worker.
+    """
+    size = len(raw_json)
+    if size > POOL_MAX_BYTES:
+        return {"error": "JSON data is too large", "error_node": "validate"}
+    pool = pool or get_pool()
+    # One byte more than the document for the cancellation flag
+    shm = shared_memory.SharedMemory(create=True, size=size + 1)
+    try:
+        shm.buf[:size] = raw_json
+        shm.buf[size] = 0
+        timeout = deadline.remaining() if deadline is not None else None
+        future = pool.submit(_generate_from_shared_memory, shm.name, size, compact, partition, timeout)
+        try:
+            return wait_for(future, deadline)
+        except BaseException:
+            # Drop the job if no worker has picked it up yet, else tell the worker to stop
+            future.cancel()
+            shm.buf[size] = 1
+            raise
+    finally:
+        shm.close()
+        shm.unlink()
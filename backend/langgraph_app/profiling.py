@@ -0,0 +1,165 @@
+# Per-request timing and profiling for the diagram pipeline
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+_current: ContextVar[Optional["RequestProfile"]] = ContextVar("request_profile", default=None)
+
+class StackSampler(threading.Thread):
+    """
+    Periodically record the call stacks of the threads currently working on a
+    request, in the collapsed format used by flamegraph tools.
+    """
+    def __init__(self, profile: "RequestProfile", interval: float):
+        super().__init__(name="stack-sampler", daemon=True)
+        self.profile = profile
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frames = sys._current_frames()
+            for ident in list(self.profile.active_threads):
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.stacks[self._collapse(frame)] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    @staticmethod
+    def _collapse(frame) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+class RequestProfile:
+    """
+    Timings for the named sections of one request, plus a cProfile profile
+    and stack samples when CPU profiling was requested.
+    """
+    def __init__(self, cpu: bool = False, sample_interval: float = 0.005):
+        self.cpu = cpu
+        self.timings: List[Tuple[str, float]] = []
+        self.profiles: List[cProfile.Profile] = []
+        self.active_threads: Dict[int, int] = {}  # Thread ident -> open section count
+        self._lock = threading.Lock()
+        self._sampler = StackSampler(self, sample_interval) if cpu else None
+
+    def start(self):
+        if self._sampler:
+            self._sampler.start()
+
+    def stop(self):
+        if self._sampler:
+            self._sampler.stop()
+
+    @contextmanager
+    def section(self, name: str, profile_thread: bool = True) -> Iterator[None]:
+        """
+        Time a named section. With profile_thread=False the section is only
+        timed: its thread is neither CPU profiled nor sampled, e.g. an event
+        loop thread whose CPU time is shared with other requests.
+        """
+        if not profile_thread:
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    self.timings.append((name, elapsed))
+            return
+        
+        ident = threading.get_ident()
+        with self._lock:
+            depth = self.active_threads.get(ident, 0)
+            self.active_threads[ident] = depth + 1
+
+        # Only the outermost section on a thread runs a profiler
+        profiler = cProfile.Profile() if self.cpu and depth == 0 else None
+        start = time.perf_counter()
+        if profiler:
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiler is already active on this thread, e.g. a
+                # concurrent request sharing the event loop thread
+                profiler = None
+        try:
+            yield
+        finally:
+            if profiler:
+                profiler.disable()
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.timings.append((name, elapsed))
+                if profiler:
+                    self.profiles.append(profiler)
+                if depth == 0:
+                    del self.active_threads[ident]
+                else:
+                    self.active_threads[ident] = depth
+
+    def server_timing(self) -> str:
+        """Format the section timings as a Server-Timing header value"""
+        return ", ".join(f"{name};dur={elapsed * 1000:.1f}" for name, elapsed in self.timings)
+
+    def save(self, directory: Path, profile_id: str) -> None:
+        """Write <id>.pstats and a flamegraph-compatible <id>.collapsed file"""
+        directory.mkdir(parents=True, exist_ok=True)
+        if self.profiles:
+            stats = pstats.Stats(self.profiles[0])
+            for profiler in self.profiles[1:]:
+                stats.add(profiler)
+            stats.dump_stats(directory / f"{profile_id}.pstats")
+        with open(directory / f"{profile_id}.collapsed", "w") as f:
+            stacks = self._sampler.stacks if self._sampler else {}
+            for stack, count in sorted(stacks.items()):
+                f.write(f"{stack} {count}\n")
+
+@contextmanager
+def request_profile(cpu: bool = False) -> Iterator[RequestProfile]:
+    """Collect timings (and, with cpu=True, a profile) for everything run inside"""
+    profile = RequestProfile(cpu=cpu)
+    token = _current.set(profile)
+    profile.start()
+    try:
+        yield profile
+    finally:
+        profile.stop()
+        _current.reset(token)
+
+@contextmanager
+def section(name: str) -> Iterator[None]:
+    """Time a named section of the current request; a no-op outside of one"""
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    with profile.section(name):
+        yield
+
+def profiled(name: str):
+    """Decorator timing every call of a function as a section"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with section(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
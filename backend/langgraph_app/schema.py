@@ -0,0 +1,288 @@
+# Structural aggregation of NDJSON / JSON-lines input
+import json
+import os
+from collections import Counter, deque
+from multiprocessing import shared_memory
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+from .deadline import Deadline, WorkerDeadline
+
+# Cap on distinct keys tracked per object, so logs keyed by IDs stay bounded
+MAX_KEYS = 100
+# Distinct sample values kept per field, and their length
+MAX_SAMPLES = 3
+MAX_SAMPLE_LENGTH = 40
+# Bounds on the schema document: levels below the root (the Mermaid emitter
+# draws no deeper either) and nodes in total. With keys and samples clipped
+# to MAX_SAMPLE_LENGTH escaped characters, a node is at most ~300 bytes of
+# JSON, so the document stays well under validate_json's 100 KB
+MAX_DOCUMENT_DEPTH = 5
+MAX_DOCUMENT_NODES = 250
+# Files are split into chunks of at least this many bytes for parallel aggregation
+MIN_CHUNK_BYTES = 8 * 1024 * 1024
+# Lines aggregated between deadline checks
+CHECK_EVERY_LINES = 1000
+
+OTHER_KEYS = "other keys"
+ARRAY_ITEMS = "[]"
+MORE_FIELDS = "more fields"
+
+def type_name(value: Any) -> str:
+    if isinstance(value, dict):
+        return "object"
+    if isinstance(value, list):
+        return "array"
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, int):
+        return "integer"
+    if isinstance(value, float):
+        return "number"
+    if value is None:
+        return "null"
+    return "string"
+
+class SchemaNode:
+    """What has been seen at one key path: types, occurrences, samples and children"""
+    __slots__ = ("count", "types", "samples", "children")
+
+    def __init__(self):
+        self.count = 0
+        self.types: Counter = Counter()
+        self.samples: List[str] = []
+        self.children: Dict[str, "SchemaNode"] = {}
+
+    def child(self, key: str) -> "SchemaNode":
+        node = self.children.get(key)
+        if node is None:
+            if len(self.children) >= MAX_KEYS and key != ARRAY_ITEMS:
+                key = OTHER_KEYS
+                node = self.children.get(key)
+            if node is None:
+                node = self.children[key] = SchemaNode()
+        return node
+
+    def observe(self, value: Any) -> None:
+        self.count += 1
+        self.types[type_name(value)] += 1
+        if not isinstance(value, (dict, list)) and value is not None and len(self.samples) < MAX_SAMPLES:
+            sample = str(value)[:MAX_SAMPLE_LENGTH]
+            if sample not in self.samples:
+                self.samples.append(sample)
+
+    def merge(self, other: "SchemaNode") -> None:
+        """Fold in a node aggregated elsewhere, e.g. from another chunk"""
+        stack = [(self, other)]
+        while stack:
+            target, source = stack.pop()
+            target.count += source.count
+            target.types.update(source.types)
+            for sample in source.samples:
+                if len(target.samples) >= MAX_SAMPLES:
+                    break
+                if sample not in target.samples:
+                    target.samples.append(sample)
+            for key, child in source.children.items():
+                stack.append((target.child(key), child))
+
+class SchemaAggregator:
+    """
+    Folds JSON records into one structural model in a single pass.
+    Memory depends on the number of distinct key paths, not on the
+    number of records.
+    """
+    def __init__(self):
+        self.root = SchemaNode()
+        self.records = 0
+        self.invalid_lines = 0
+
+    def add(self, record: Any) -> None:
+        self.records += 1
+        stack = [(self.root, record)]
+        while stack:
+            node, value = stack.pop()
+            node.observe(value)
+            if isinstance(value, dict):
+                for key, child in value.items():
+                    stack.append((node.child(key), child))
+            elif isinstance(value, list):
+                items = node.child(ARRAY_ITEMS) if value else None
+                for item in value:
+                    stack.append((items, item))
+
+    def add_line(self, line: Union[bytes, str]) -> None:
+        """Add one NDJSON line; blank lines are skipped and bad ones counted"""
+        if not line.strip():
+            return
+        try:
+            record = json.loads(line)
+        except ValueError:
+            self.invalid_lines += 1
+            return
+        self.add(record)
+
+    def add_lines(self, lines: Iterable[Union[bytes, str]], deadline: Optional[Deadline] = None) -> "SchemaAggregator":
+        """
+        Add NDJSON lines, raising TimeoutError once the deadline has passed
+        or the request was cancelled.
+        """
+        for count, line in enumerate(lines, 1):
+            self.add_line(line)
+            if deadline is not None and count % CHECK_EVERY_LINES == 0 and deadline.expired():
+                raise TimeoutError("Ran out of time aggregating NDJSON records")
+        return self
+
+    def merge(self, other: "SchemaAggregator") -> None:
+        self.root.merge(other.root)
+        self.records += other.records
+        self.invalid_lines += other.invalid_lines
+
+    def to_document(self) -> Dict[str, Any]:
+        """
+        Describe the aggregated structure as a JSON document for Mermaid
+        generation. Objects become nested keys labelled with how often
+        they occurred; every other field becomes a "types ×count e.g.
+        samples" summary. Labels avoid brackets and pipes, which Mermaid
+        would read as syntax.
+
+        The document stays within MAX_DOCUMENT_DEPTH levels and
+        MAX_DOCUMENT_NODES nodes however wide the log is, so it always
+        passes validate_json. Levels are filled breadth first; fields that
+        don't fit are counted under a "more fields" key.
+        """
+        document: Dict[str, Any] = {}
+        # Nodes left to place. Every queued object holds one back for its
+        # own "more fields" note, the root included.
+        remaining = MAX_DOCUMENT_NODES - 1
+        # Frames are (node, the dict to fill with its children, depth of those children)
+        queue = deque([(self.root, document, 0)])
+        while queue:
+            node, target, depth = queue.popleft()
+            remaining += 1
+            children = list(node.children.items())
+            for index, (key, child) in enumerate(children):
+                scalar_types = {t: n for t, n in child.types.items() if t not in ("object", "array")}
+                # Keep room for the note in case a later sibling doesn't fit
+                reserve = 1 if index + 1 < len(children) else 0
+                # Objects that can't be expanded in the room left are summarized
+                expand = (
+                    bool(child.children)
+                    and depth < MAX_DOCUMENT_DEPTH
+                    and 2 + bool(scalar_types) + reserve <= remaining
+                )
+                if 1 + reserve > remaining:
+                    target[MORE_FIELDS] = f"{len(children) - index} not shown"
+                    remaining -= 1
+                    break
+                # Keys can clash once clipped, so repeated labels are numbered
+                name, n = "items" if key == ARRAY_ITEMS else clip(key), 2
+                label = f"{name} ×{child.count}"
+                while label in target:
+                    label, n = f"{name} {n} ×{child.count}", n + 1
+                if expand:
+                    target[label] = {}
+                    if scalar_types:
+                        target[label]["scalar values"] = describe(scalar_types, child.samples)
+                    queue.append((child, target[label], depth + 1))
+                    remaining -= 2 + bool(scalar_types)
+                else:
+                    target[label] = describe(child.types, child.samples)
+                    remaining -= 1
+        if not document:
+            document[f"records ×{self.records}"] = describe(self.root.types, self.root.samples)
+        return document
+
+    def summary(self) -> Dict[str, int]:
+        return {"records": self.records, "invalid_lines": self.invalid_lines}
+
+def describe(types: Dict[str, int], samples: List[str]) -> str:
+    """Leaf label such as "string or null ×980 e.g. a, b" """
+    text = " or ".join(t for t, _ in Counter(types).most_common())
+    text += f" ×{sum(types.values())}"
+    if samples:
+        text += " e.g. " + ", ".join(clip(sample) for sample in samples)
+    return text
+
+def clip(text: str) -> str:
+    """Cut text to MAX_SAMPLE_LENGTH characters as escaped by json.dumps"""
+    text = text[:MAX_SAMPLE_LENGTH]
+    while len(json.dumps(text)) - 2 > MAX_SAMPLE_LENGTH:
+        text = text[:-1]
+    return text
+
+def _lines_in_range(f, start: int, end: int) -> Iterable[bytes]:
+    """Lines of an open binary file that start within [start, end)"""
+    if start > 0:
+        # A line straddling start belongs to the previous range
+        f.seek(start - 1)
+        f.readline()
+    while f.tell() < end:
+        line = f.readline()
+        if not line:
+            return
+        yield line
+
+def _aggregate_range(
+    path: str,
+    start: int,
+    end: int,
+    timeout: Optional[float] = None,
+    cancel_flag: Optional[str] = None,
+) -> SchemaAggregator:
+    """
+    Aggregate the lines that start within [start, end) of a file, giving
+    up with TimeoutError after timeout seconds, or once the first byte of
+    the shared memory block named cancel_flag is set.
+    """
+    flag = shared_memory.SharedMemory(name=cancel_flag) if cancel_flag is not None else None
+    try:
+        if flag is not None:
+            deadline = WorkerDeadline(timeout, flag.buf, 0)
+        else:
+            deadline = Deadline(timeout) if timeout is not None else None
+        with open(path, "rb") as f:
+            return SchemaAggregator().add_lines(_lines_in_range(f, start, end), deadline)
+    finally:
+        if flag is not None:
+            flag.close()
+
+def byte_ranges(size: int, chunks: int) -> List[Tuple[int, int]]:
+    step = -(-size // chunks)
+    return [(start, min(start + step, size)) for start in range(0, size, step)]
+
+def aggregate_ndjson_file(path: str, workers: int = 1, deadline: Optional[Deadline] = None) -> SchemaAggregator:
+    """
+    Aggregate an NDJSON file, splitting large files into byte ranges that
+    are aggregated in the process pool and then merged. Raises TimeoutError
+    once the deadline has passed or the request was cancelled.
+    """
+    size = os.path.getsize(path)
+    chunks = min(workers, size // MIN_CHUNK_BYTES)
+    if chunks <= 1:
+        with open(path, "rb") as f:
+            return SchemaAggregator().add_lines(_lines_in_range(f, 0, size), deadline)
+
+    from .pool import get_pool, wait_for
+    pool = get_pool()
+    # Workers can't share the Deadline: each stops itself after the time left
+    # now, or as soon as the request sets the cancellation flag
+    timeout = deadline.remaining() if deadline is not None else None
+    flag = shared_memory.SharedMemory(create=True, size=1)
+    flag.buf[0] = 0
+    futures = [
+        pool.submit(_aggregate_range, path, start, end, timeout, flag.name)
+        for start, end in byte_ranges(size, chunks)
+    ]
+    aggregator = SchemaAggregator()
+    try:
+        for future in futures:
+            aggregator.merge(wait_for(future, deadline))
+    except BaseException:
+        flag.buf[0] = 1
+        raise
+    finally:
+        for future in futures:
+            future.cancel()
+        flag.close()
+        flag.unlink()
+    return aggregator
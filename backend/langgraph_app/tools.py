@@ -1,141 +1,426 @@
 # Import necessary libraries
+import hashlib
+import itertools
 import json
-from typing import Dict, Any, List
+import string
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+from .deadline import Deadline, remaining_or
 
-def parse_json_to_mermaid(json_data: Dict[Any, Any]) -> str:
+def sanitize_label(label):
+    """Sanitize labels to avoid Mermaid syntax issues"""
+    # Convert to string and escape special characters
+    if not isinstance(label, str):
+        label = str(label)
+    
+    # Replace characters that could cause issues in Mermaid
+    label = label.replace('"', '\\"')
+    label = label.replace(':', ' -')
+    label = label.replace(';', ',')
+    
+    # Truncate very long labels
+    if len(label) > 50:
+        label = label[:47] + "..."
+        
+    return label
+
+def sanitize_id(node_id):
+    """Create a sanitized node ID for Mermaid diagrams"""
+    return f'"{node_id}"'
+
+def _item_label(index, item):
+    """Label for an array item: the property name of single-key objects, else its index"""
+    if isinstance(item, dict) and len(item) == 1:
+        return next(iter(item))
+    return f"Item {index}"
+
+def _root_entries(json_data):
+    """Top-level (label, value) pairs the diagram starts from"""
+    if isinstance(json_data, dict):
+        return list(json_data.items())
+    if isinstance(json_data, list):
+        return [(_item_label(i, item), item) for i, item in enumerate(json_data)]
+    # Handle primitive types
+    return [("Value", json_data)]
+
+# Words the Mermaid flowchart lexer treats as keywords (case-insensitively)
+MERMAID_KEYWORDS = {"end", "graph", "flowchart", "subgraph", "style", "class", "classdef",
+                    "click", "linkstyle", "direction", "call", "href", "default"}
+
+# Styles for the node classes used in compact mode
+COMPACT_CLASS_DEFS = {
+    "k": "fill:#e8f0fe,stroke:#4a6fa5",  # Keys and containers
+    "v": "fill:#f1f8e9,stroke:#7cb342",  # Key: value leaves
+    "a": "fill:#fff3e0,stroke:#fb8c00",  # Summarized arrays
+    "p": "fill:#f3e5f5,stroke:#8e24aa,stroke-dasharray:4",  # Links to other pages
+}
+
+def short_ids() -> Iterator[str]:
     """
-    Parse JSON data and convert it to Mermaid diagram syntax.
-    This will be called by the LangGraph agent.
+    Yield the shortest usable Mermaid node IDs in order: a, b, ..., Z, aa, ab, ...
+    IDs never start with o or x, which Mermaid can read as an edge ending,
+    and never spell a keyword.
+    """
+    first_chars = [c for c in string.ascii_letters if c not in "oxOX"]
+    other_chars = string.ascii_letters + string.digits
+    for length in itertools.count(1):
+        for first in first_chars:
+            for rest in itertools.product(other_chars, repeat=length - 1):
+                node_id = first + "".join(rest)
+                if node_id.lower() not in MERMAID_KEYWORDS:
+                    yield node_id
+
+def _iter_compact_mermaid(json_data: Any, links: Optional[Dict[int, str]] = None) -> Iterator[str]:
     """
-    # Basic implementation - improve based on your requirements
-    mermaid_code = "graph TD;\n"
+    Compact variant of iter_json_to_mermaid().
+
+    Nodes get the shortest free ID and are defined inline the first time
+    they appear, so each label is written exactly once. A parent and all
+    of its children share one fan-out edge line (a-->b[x] & c[y]). A key
+    holding a primitive becomes a single "key: value" node, and styling
+    uses one class statement per node kind instead of per-node styles.
+    """
+    yield "graph TD\n"
+    for kind, style in COMPACT_CLASS_DEFS.items():
+        yield f"classDef {kind} {style}\n"
     
-    # Keep track of nodes to avoid duplicates
-    nodes = set()
-    edges = []
+    ids = short_ids()
+    members = {kind: [] for kind in COMPACT_CLASS_DEFS}
+    clicks = []
     
-    def sanitize_label(label):
-        """Sanitize labels to avoid Mermaid syntax issues"""
-        # Convert to string and escape special characters
-        if not isinstance(label, str):
-            label = str(label)
-        
-        # Replace characters that could cause issues in Mermaid
-        label = label.replace('"', '\\"')
-        label = label.replace(':', ' -')
-        label = label.replace(';', ',')
+    def define(key, value):
+        """Allocate a node, returning its ID, inline definition and children"""
+        node_id = next(ids)
+        children = []
+        if links and id(value) in links:
+            kind, label = "p", f"{sanitize_label(key)} ↗"
+            clicks.append(f'click {node_id} href "{links[id(value)]}"\n')
+        elif isinstance(value, dict):
+            kind, label = "k", sanitize_label(key)
+            children = list(value.items())
+        elif isinstance(value, list) and len(value) > 10:
+            # Limit number of array items to prevent diagram overload
+            kind, label = "a", f"{sanitize_label(key)}: Array with {len(value)} items"
+        elif isinstance(value, list):
+            kind, label = "k", sanitize_label(key)
+            children = [(_item_label(i, item), item) for i, item in enumerate(value)]
+        elif value is None:
+            kind, label = "k", sanitize_label(key)
+        else:
+            # sanitize_label() strips colons, so the separator is unambiguous
+            kind, label = "v", f"{sanitize_label(key)}: {sanitize_label(value)}"
+        members[kind].append(node_id)
+        return node_id, f"{node_id}[{label}]", children
+    
+    for key, value in _root_entries(json_data):
+        _, definition, children = define(key, value)
+        if not children:
+            yield f"{definition}\n"
+            continue
         
-        # Truncate very long labels
-        if len(label) > 50:
-            label = label[:47] + "..."
-            
-        return label
+        # Frames are (head, children, depth) for nodes whose children are still to be drawn
+        stack = [(definition, children, 0)]
+        while stack:
+            head, children, depth = stack.pop()
+            targets = []
+            nested = []
+            for child_key, child_value in children:
+                child_id, child_definition, grandchildren = define(child_key, child_value)
+                targets.append(child_definition)
+                # Nodes deeper than 5 levels are left out, as in the default mode
+                if grandchildren and depth + 1 < 5:
+                    nested.append((child_id, grandchildren, depth + 1))
+            yield f"{head}-->{' & '.join(targets)}\n"
+            stack.extend(reversed(nested))
     
-    def sanitize_id(node_id):
-        """Create a sanitized node ID for Mermaid diagrams"""
-        return f'"{node_id}"'
+    for kind, node_ids in members.items():
+        if node_ids:
+            yield f"class {','.join(node_ids)} {kind}\n"
+    yield from clicks
+
+def iter_json_to_mermaid(
+    json_data: Any,
+    compact: bool = False,
+    links: Optional[Dict[int, str]] = None,
+) -> Iterator[str]:
+    """
+    Yield Mermaid diagram syntax for JSON data one line at a time.
+
+    The tree is walked with an explicit stack rather than recursion, so deeply
+    nested input cannot raise RecursionError and nothing is buffered beyond the
+    pending stack frames. Joining the yielded lines gives parse_json_to_mermaid().
+    With compact=True the much smaller syntax of _iter_compact_mermaid() is used.
+
+    links maps id() of container values to URLs; those values are drawn as a
+    single clickable node instead of being expanded (see partition_json_to_mermaid).
+    """
+    if compact:
+        yield from _iter_compact_mermaid(json_data, links)
+        return
     
-    def process_value(key, value, parent_id=None, depth=0):
-        """Recursively process JSON values, creating nodes and edges"""
-        if depth > 5:  # Limit recursion depth to prevent overly complex diagrams
-            return
-        
-        node_id = f"N{len(nodes)}"
-        key_label = sanitize_label(key)
+    yield "graph TD;\n"
+    
+    # Node IDs share a single counter across the N/V/A prefixes
+    counter = 0
+    
+    # Frames are (key, value, parent_id, depth); pushed in reverse so that
+    # siblings are emitted in document order
+    stack = [(key, value, None, 0) for key, value in reversed(_root_entries(json_data))]
+    
+    while stack:
+        key, value, parent_id, depth = stack.pop()
+        if depth > 5:  # Limit depth to prevent overly complex diagrams
+            continue
         
-        # Add node
-        node_def = f"    {sanitize_id(node_id)}[{key_label}]\n"
-        if node_def not in nodes:
-            nodes.add(node_def)
-            mermaid_code_parts.append(node_def)
+        node_id = f"N{counter}"
+        counter += 1
+        yield f"    {sanitize_id(node_id)}[{sanitize_label(key)}]\n"
         
         # Add edge from parent if exists
         if parent_id is not None:
-            edge = f"    {sanitize_id(parent_id)} --> {sanitize_id(node_id)}\n"
-            if edge not in edges:
-                edges.append(edge)
-                mermaid_code_parts.append(edge)
+            yield f"    {sanitize_id(parent_id)} --> {sanitize_id(node_id)}\n"
+        
+        # Subtrees drawn on another page link to it instead
+        if links and id(value) in links:
+            yield f'    click {sanitize_id(node_id)} href "{links[id(value)]}"\n'
+            continue
         
         # Process children based on type
         if isinstance(value, dict):
-            for k, v in value.items():
-                process_value(k, v, node_id, depth + 1)
+            for k, v in reversed(list(value.items())):
+                stack.append((k, v, node_id, depth + 1))
         elif isinstance(value, list):
-            # For arrays, create child nodes for each item
             if len(value) > 10:  # Limit number of array items to prevent diagram overload
-                array_node_id = f"A{len(nodes)}"
-                array_node = f"    {sanitize_id(array_node_id)}[Array with {len(value)} items]\n"
-                if array_node not in nodes:
-                    nodes.add(array_node)
-                    mermaid_code_parts.append(array_node)
-                
-                array_edge = f"    {sanitize_id(node_id)} --> {sanitize_id(array_node_id)}\n"
-                if array_edge not in edges:
-                    edges.append(array_edge)
-                    mermaid_code_parts.append(array_edge)
+                array_node_id = f"A{counter}"
+                counter += 1
+                yield f"    {sanitize_id(array_node_id)}[Array with {len(value)} items]\n"
+                yield f"    {sanitize_id(node_id)} --> {sanitize_id(array_node_id)}\n"
             else:
-                for i, item in enumerate(value):
-                    item_label = f"Item {i}"
-                    if isinstance(item, dict) and len(item) == 1:
-                        # If it's a single property dict, use the property name
-                        item_label = list(item.keys())[0]
-                    
-                    process_value(item_label, item, node_id, depth + 1)
-        else:
+                for i in range(len(value) - 1, -1, -1):
+                    stack.append((_item_label(i, value[i]), value[i], node_id, depth + 1))
+        elif value is not None:  # Skip None values
             # For primitive values, add a value node
-            if value is not None:  # Skip None values
-                value_id = f"V{len(nodes)}"
-                value_label = sanitize_label(value)
-                value_node = f"    {sanitize_id(value_id)}[{value_label}]\n"
-                
-                if value_node not in nodes:
-                    nodes.add(value_node)
-                    mermaid_code_parts.append(value_node)
-                
-                value_edge = f"    {sanitize_id(node_id)} --> {sanitize_id(value_id)}\n"
-                if value_edge not in edges:
-                    edges.append(value_edge)
-                    mermaid_code_parts.append(value_edge)
-    
-    # Initialize the mermaid code parts
-    mermaid_code_parts = [mermaid_code]
-    
-    # Root level processing
-    if isinstance(json_data, dict):
-        for key, value in json_data.items():
-            process_value(key, value)
-    elif isinstance(json_data, list):
-        for i, item in enumerate(json_data):
-            item_label = f"Item {i}"
-            if isinstance(item, dict) and len(item) == 1:
-                item_label = list(item.keys())[0]
-            process_value(item_label, item)
-    else:
-        # Handle primitive types
-        process_value("Value", json_data)
-    
-    # Join all parts
-    return "".join(mermaid_code_parts)
-
-def validate_json(json_data: Dict[Any, Any]) -> bool:
+            value_id = f"V{counter}"
+            counter += 1
+            yield f"    {sanitize_id(value_id)}[{sanitize_label(value)}]\n"
+            yield f"    {sanitize_id(node_id)} --> {sanitize_id(value_id)}\n"
+
+def parse_json_to_mermaid(json_data: Dict[Any, Any], compact: bool = False) -> str:
+    """
+    Parse JSON data and convert it to Mermaid diagram syntax.
+    This will be called by the LangGraph agent.
+    Set compact=True for the shorter output used to keep render URLs small.
+    """
+    return "".join(iter_json_to_mermaid(json_data, compact))
+
+def count_diagram_nodes(value: Any, depth: int = 0) -> int:
+    """
+    Number of nodes iter_json_to_mermaid() draws for a value whose key node
+    sits at the given depth, including the key node itself.
+    """
+    count = 0
+    stack = [(value, depth)]
+    while stack:
+        value, depth = stack.pop()
+        if depth > 5:
+            continue
+        count += 1
+        if isinstance(value, dict):
+            stack.extend((v, depth + 1) for v in value.values())
+        elif isinstance(value, list):
+            if len(value) > 10:
+                count += 1
+            else:
+                stack.extend((item, depth + 1) for item in value)
+        elif value is not None:
+            count += 1
+    return count
+
+def _child_entries(value: Any) -> List[Tuple[str, Any]]:
+    """(label, value) pairs drawn under a container's key node"""
+    if isinstance(value, dict):
+        return list(value.items())
+    return [(_item_label(i, item), item) for i, item in enumerate(value)]
+
+def _unique_labels(entries: List[Tuple[str, Any]]) -> Dict[str, Any]:
+    """Entries as a dict to draw, numbering repeated labels such as the keys of single-key array items"""
+    result: Dict[str, Any] = {}
+    for label, value in entries:
+        unique, n = str(label), 2
+        while unique in result:
+            unique, n = f"{label} {n}", n + 1
+        result[unique] = value
+    return result
+
+def _span_title(entries: List[Tuple[str, Any]]) -> str:
+    """Title of a page holding a run of sibling entries"""
+    if len(entries) == 1:
+        return str(entries[0][0])
+    return f"{entries[0][0]} … {entries[-1][0]}"
+
+def _pack(entries: List[Tuple[str, Any]], sizes: List[int], budget: int) -> List[List[Tuple[str, Any]]]:
+    """Split entries, in order, into runs of at most budget nodes"""
+    runs: List[List[Tuple[str, Any]]] = []
+    run: List[Tuple[str, Any]] = []
+    total = 0
+    for entry, size in zip(entries, sizes):
+        if run and total + size > budget:
+            runs.append(run)
+            run, total = [], 0
+        run.append(entry)
+        total += size
+    if run:
+        runs.append(run)
+    return runs
+
+def partition_json(json_data: Any, node_budget: int) -> List[Dict[str, Any]]:
+    """
+    Split a document into pages of at most roughly node_budget nodes.
+
+    Returns a list of pages, the overview first. Each page holds its "id",
+    "title", the "data" it draws and the "links" map for iter_json_to_mermaid().
+    If the whole document fits the budget the overview is the only page.
+
+    Otherwise each level of a page is filled as follows. Subtrees over the
+    budget are drawn as a link to a page of their own, which is split the
+    same way. Runs of smaller sibling entries stay on the page if they fit,
+    else they are packed in document order into pages of up to the budget.
+    If a level still has more link nodes than the budget allows, the links
+    are gathered into index pages, so the overview stays within budget too.
+    """
+    node_budget = max(node_budget, 4)
+    entries = _root_entries(json_data)
+    overview = {"id": "overview", "title": "Overview", "data": json_data, "links": {}}
+    pages = [overview]
+    if sum(count_diagram_nodes(value) for _, value in entries) <= node_budget:
+        return pages
+    
+    def new_page(title: str) -> Dict[str, Any]:
+        page = {"id": f"page-{len(pages)}", "title": sanitize_label(title), "data": {}, "links": {}}
+        pages.append(page)
+        return page
+    
+    def link(page, label, target_page, value) -> Tuple[str, Any]:
+        """A single link node on page, drawn for value, pointing at target_page"""
+        page["links"][id(value)] = f"#{target_page['id']}"
+        return (label, value)
+    
+    def subtree_page(label, value) -> Dict[str, Any]:
+        """Page drawing one over-budget subtree: its key node, then its children laid out"""
+        page = new_page(label)
+        page["data"] = {label: lay_out(page, _child_entries(value), 1, node_budget - 1)}
+        return page
+    
+    def run_page(run) -> Dict[str, Any]:
+        """Page drawing a run of sibling entries as its top level"""
+        page = new_page(_span_title(run))
+        page["data"] = lay_out(page, run, 0, node_budget)
+        return page
+    
+    def lay_out(page, entries, depth, budget) -> Dict[str, Any]:
+        """What page draws for entries at depth, in at most budget nodes"""
+        sizes = [count_diagram_nodes(value, depth) for _, value in entries]
+        if sum(sizes) <= budget:
+            return _unique_labels(entries)
+        
+        # Over-budget subtrees become links; runs of the others stay together
+        segments = []  # (is_subtree, entries)
+        small = 0
+        for entry, size in zip(entries, sizes):
+            if size > budget:
+                segments.append((True, [entry]))
+            else:
+                small += size
+                if segments and not segments[-1][0]:
+                    segments[-1][1].append(entry)
+                else:
+                    segments.append((False, [entry]))
+        subtrees = sum(1 for is_subtree, _ in segments if is_subtree)
+        keep_small = small + subtrees <= budget
+        
+        items = []
+        for is_subtree, run in segments:
+            if is_subtree:
+                label, value = run[0]
+                items.append(link(page, label, subtree_page(label, value), value))
+            elif keep_small:
+                items.extend(run)
+            else:
+                # Sizes on the new pages are counted from the top level
+                run_sizes = [count_diagram_nodes(value) for _, value in run]
+                for group in _pack(run, run_sizes, node_budget):
+                    target = run_page(group)
+                    items.append(link(page, _span_title(group), target, target["data"]))
+        
+        # Too many links for one level: gather them into index pages
+        while not keep_small and len(items) > budget:
+            indexed = []
+            for start in range(0, len(items), node_budget):
+                chunk = items[start:start + node_budget]
+                index = new_page(_span_title(chunk))
+                for label, value in chunk:
+                    index["links"][id(value)] = page["links"].pop(id(value))
+                index["data"] = _unique_labels(chunk)
+                indexed.append(link(page, _span_title(chunk), index, index["data"]))
+            items = indexed
+        return _unique_labels(items)
+    
+    overview["data"] = lay_out(overview, entries, 0, node_budget)
+    return pages
+
+def partition_json_to_mermaid(json_data: Any, node_budget: int, compact: bool = False) -> List[Dict[str, str]]:
+    """
+    Generate linked Mermaid diagrams for a document split by partition_json().
+    Returns a manifest of pages with "id", "title" and "mermaid_code", the
+    overview first; link nodes point at "#<page id>".
+    """
+    return [
+        {
+            "id": page["id"],
+            "title": page["title"],
+            "mermaid_code": "".join(iter_json_to_mermaid(page["data"], compact, page["links"])),
+        }
+        for page in partition_json(json_data, node_budget)
+    ]
+
+def canonical_hash(json_data: Any) -> str:
+    """
+    Hash a JSON document independently of key order and whitespace,
+    so that equivalent submissions map to the same stored diagram.
+    """
+    canonical = json.dumps(json_data, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def validate_json(json_data: Dict[Any, Any], max_bytes: Optional[int] = 100000) -> bool:
     """
     Validate if the JSON can be processed for diagram generation.
+    Pass max_bytes=None when the size was already checked on the raw bytes.
     """
     # Check if json_data is a dictionary
     if not isinstance(json_data, dict) and not isinstance(json_data, list):
         raise ValueError("JSON data must be an object or array")
     
     # Check if the JSON is too large
-    json_str = json.dumps(json_data)
-    if len(json_str) > 100000:  # Limit to 100KB
+    if max_bytes is not None and len(json.dumps(json_data)) > max_bytes:
         raise ValueError("JSON data is too large")
     
     return True
 
-def generate_svg_from_mermaid(mermaid_code: str) -> str:
+def is_fallback_svg(svg: str) -> bool:
+    """
+    Check whether an SVG is one of the placeholders produced by
+    generate_svg_from_mermaid() rather than a rendered diagram.
+    """
+    return "Error Generating Diagram" in svg or "rendering services unavailable" in svg
+
+# Rendering services aren't called with less time than this left before the deadline
+MIN_RENDER_SECONDS = 1.0
+
+def generate_svg_from_mermaid(mermaid_code: str, deadline: Optional[Deadline] = None) -> str:
     """
     Generate SVG from Mermaid code.
     Uses the Mermaid.ink service to render the diagram.
+    With a deadline, every HTTP timeout is capped to the time left and
+    services that could not answer in time are skipped.
     """
     import base64
     import requests
@@ -159,26 +444,30 @@ def generate_svg_from_mermaid(mermaid_code: str) -> str:
         url = f"https://mermaid.ink/svg/{encoded}"
         logger.info(f"Requesting SVG from: {url}")
         
-        response = requests.get(url, timeout=10)
-        
-        if response.status_code == 200:
-            return response.text
+        if deadline is None or deadline.allows(MIN_RENDER_SECONDS):
+            response = requests.get(url, timeout=remaining_or(deadline, 10))
+            
+            if response.status_code == 200:
+                return response.text
+            
+            logger.warning(f"Mermaid.ink failed with status {response.status_code}, trying fallback service")
         
         # Second attempt: Try the alternative service quickchart.io
-        logger.warning(f"Mermaid.ink failed with status {response.status_code}, trying fallback service")
-        
-        # Prepare the request to quickchart.io
-        quickchart_url = "https://quickchart.io/graphviz"
-        payload = {
-            "graph": "digraph { " + 
-                     " ".join([line.strip() for line in mermaid_code.split('\n') 
-                              if '-->' in line or '-.->' in line]) + " }"
-        }
-        
-        response = requests.post(quickchart_url, json=payload, timeout=10)
-        
-        if response.status_code == 200:
-            return response.text
+        if deadline is None or deadline.allows(MIN_RENDER_SECONDS):
+            # Prepare the request to quickchart.io
+            quickchart_url = "https://quickchart.io/graphviz"
+            payload = {
+                "graph": "digraph { " + 
+                         " ".join([line.strip() for line in mermaid_code.split('\n') 
+                                  if '-->' in line or '-.->' in line]) + " }"
+            }
+            
+            response = requests.post(quickchart_url, json=payload, timeout=remaining_or(deadline, 10))
+            
+            if response.status_code == 200:
+                return response.text
+        else:
+            logger.warning("Not enough time left before the request deadline, skipping rendering services")
         
         # Third attempt: Generate a simple SVG placeholder
         logger.error(f"All rendering services failed. Creating placeholder SVG.")
@@ -7,7 +7,8 @@ const JsonUploader = ({ onUploadStart, onDiagramGenerated, onError }) => {
 
   const handleFileChange = (e) => {
     const selectedFile = e.target.files[0];
-    if (selectedFile && selectedFile.type === 'application/json') {
+    const isJsonLines = selectedFile && /\.(ndjson|jsonl)$/i.test(selectedFile.name);
+    if (selectedFile && (selectedFile.type === 'application/json' || isJsonLines)) {
       setFile(selectedFile);
     } else {
       setFile(null);
@@ -30,9 +31,9 @@ const JsonUploader = ({ onUploadStart, onDiagramGenerated, onError }) => {
     formData.append('file', file);
 
     try {
-      // Send to Django backend
+      // Send to Django backend; the diagram is rendered in the browser
       const response = await axios.post(
-        'http://localhost:8000/api/process-json/',
+        'http://localhost:8000/api/process-json/?render=client&compact=1',
         formData,
         {
           headers: {
@@ -59,7 +60,7 @@ const JsonUploader = ({ onUploadStart, onDiagramGenerated, onError }) => {
           <input
             type="file"
             id="json-file"
-            accept=".json"
+            accept=".json,.ndjson,.jsonl"
             onChange={handleFileChange}
           />
           <label htmlFor="json-file" className="file-label">
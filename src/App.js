@@ -39,7 +39,7 @@ function App() {
         {loading && <div className="loading">Generating diagram...</div>}
         {error && <div className="error">{error}</div>}
         
-        {diagram && (
+        {(diagram || mermaidCode) && (
           <DiagramViewer 
             svgContent={diagram} 
             mermaidCode={mermaidCode}
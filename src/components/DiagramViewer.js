@@ -1,13 +1,43 @@
-import React, { useState } from 'react';
+import React, { useEffect, useState } from 'react';
 import { Mermaid } from 'mermaid-react';
 import './DiagramViewer.css';
 
 const DiagramViewer = ({ svgContent, mermaidCode }) => {
   const [activeTab, setActiveTab] = useState('diagram');
+  const [clientSvg, setClientSvg] = useState('');
+  const [renderError, setRenderError] = useState('');
+
+  // Without a server-rendered SVG, render the Mermaid code in the browser.
+  // mermaid.js is only loaded on first use, so it stays out of the main bundle.
+  useEffect(() => {
+    if (svgContent || !mermaidCode) {
+      return undefined;
+    }
+    let cancelled = false;
+    setClientSvg('');
+    setRenderError('');
+    import('mermaid')
+      .then(({ default: mermaid }) => {
+        // Labels come from user JSON, and the SVG is injected as HTML below
+        mermaid.initialize({ startOnLoad: false, securityLevel: 'strict' });
+        return new Promise((resolve) => mermaid.render(`diagram-${Date.now()}`, mermaidCode, resolve));
+      })
+      .then((svg) => {
+        if (!cancelled) setClientSvg(svg);
+      })
+      .catch((error) => {
+        if (!cancelled) setRenderError(`Could not render the diagram: ${error.message}`);
+      });
+    return () => {
+      cancelled = true;
+    };
+  }, [svgContent, mermaidCode]);
+
+  const diagramSvg = svgContent || clientSvg;
   
   // Function to download the SVG
   const downloadSVG = () => {
-    const blob = new Blob([svgContent], { type: 'image/svg+xml' });
+    const blob = new Blob([diagramSvg], { type: 'image/svg+xml' });
     const url = URL.createObjectURL(blob);
     const a = document.createElement('a');
     a.href = url;
@@ -38,13 +68,16 @@ const DiagramViewer = ({ svgContent, mermaidCode }) => {
       <div className="tab-content">
         {activeTab === 'diagram' && (
           <div className="diagram-container">
+            {renderError && <div className="error">{renderError}</div>}
+            {!diagramSvg && !renderError && <div className="loading">Rendering diagram...</div>}
             <div 
               className="diagram" 
-              dangerouslySetInnerHTML={{ __html: svgContent }} 
+              dangerouslySetInnerHTML={{ __html: diagramSvg }} 
             />
             <button 
               className="download-button" 
               onClick={downloadSVG}
+              disabled={!diagramSvg}
             >
               Download SVG
             </button>